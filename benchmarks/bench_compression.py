@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+#############################################################################
+### Benchmarks the compression backends of demuxtools.fastqio on a synthetic
+### FASTQ file: compression time and size per write backend, and
+### decompression time per read backend.
+###
+### Usage example: python benchmarks/bench_compression.py --reads 500000 --threads 4
+#############################################################################
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from demuxtools.fastqio import openFastq, availableReadBackends, availableWriteBackends
+from synthetic import makeFastqRecords
+
+#############################################################################
+# Functions
+#############################################################################
+def timeWrite( data, file, backend, level, threads ):
+    """
+    Compresses data to file with a write backend. Returns the elapsed time in seconds.
+    """
+    st=time.perf_counter()
+    with openFastq(file, 'wb', write_backend=backend, level=level, threads=threads) as fq:
+        for i in range(0, len(data), 1 << 20):
+            fq.write(data[i:i+(1 << 20)])
+    return(time.perf_counter()-st)
+
+def timeRead( file, backend ):
+    """
+    Decompresses file line by line in text mode, as the FASTQ parsers do, with a read backend. Returns the elapsed time in seconds.
+    """
+    st=time.perf_counter()
+    with openFastq(file, 'rt', read_backend=backend) as fq:
+        for line in fq:
+            pass
+    return(time.perf_counter()-st)
+
+def runBenchmark( n_reads, levels, threads, repeat ):
+    """
+    Runs all available write backends at the given levels and thread counts, then all available read backends on the gzip output.
+    Returns a list of result dicts.
+    """
+    data=makeFastqRecords(n_reads)
+    results=[]
+    with tempfile.TemporaryDirectory() as tmp:
+        reference=os.path.join(tmp, 'reference.fastq.gz')
+        with gzip.open(reference, 'wb', compresslevel=6) as fq:
+            fq.write(data)
+        for backend in availableWriteBackends():
+            for level in levels:
+                for n_threads in ([1] if backend == 'gzip' else threads):
+                    file=os.path.join(tmp, 'out.fastq.gz')
+                    elapsed=min(timeWrite(data, file, backend, level, n_threads) for _ in range(repeat))
+                    if gzip.open(file).read() != data:
+                        sys.exit("[FATAL] Backend "+backend+" did not round-trip the data.")
+                    results.append({'operation': 'write', 'backend': backend, 'level': level, 'threads': n_threads,
+                                    'seconds': round(elapsed, 4), 'MB_per_s': round(len(data)/elapsed/1e6, 1),
+                                    'ratio': round(len(data)/os.path.getsize(file), 2)})
+        for backend in availableReadBackends():
+            elapsed=min(timeRead(reference, backend) for _ in range(repeat))
+            results.append({'operation': 'read', 'backend': backend, 'level': 6, 'threads': 1,
+                            'seconds': round(elapsed, 4), 'MB_per_s': round(len(data)/elapsed/1e6, 1), 'ratio': None})
+    return(results)
+
+#############################################################################
+#                                      MAIN
+#############################################################################
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Benchmarks the fastq.gz compression backends on a synthetic FASTQ file.')
+    parser.add_argument('--reads', type=int, default=200000, help='Number of synthetic reads (default: 200000).')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9], help='Compression levels (default: 1 6 9).')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, os.cpu_count() or 1], help='Compression thread counts (default: 1 and all cores).')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement, the best is kept (default: 3).')
+    parser.add_argument('--json', help='Write the results to this JSON file.')
+    args=parser.parse_args()
+
+    results=runBenchmark(args.reads, args.levels, sorted(set(args.threads)), args.repeat)
+    print("%-6s %-8s %5s %7s %9s %8s %6s" % ('op', 'backend', 'level', 'threads', 'seconds', 'MB/s', 'ratio'))
+    for r in results:
+        print("%-6s %-8s %5s %7s %9.3f %8.1f %6s" % (r['operation'], r['backend'], r['level'], r['threads'], r['seconds'], r['MB_per_s'], r['ratio'] or '-'))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
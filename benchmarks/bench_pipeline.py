@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+#############################################################################
+### Benchmarks the DEMUX scripts on synthetic run folders (see
+### synthetic.makeRunFolder) at several scales:
+###   clean : sortUndetermined_bcl2fastq.12.py, lane indexes of the project
+###           R1 fastqs and cleaning of all Undetermined fastqs
+###   tiles : sortReadsPerTIle.py, read coordinates file and tile files
+### The scripts are run by their command line in a fresh process each, on the
+### run folder as it was generated, so that the same harness times the tree
+### of any commit (--repo, e.g. a git worktree of an older commit) and the
+### peak memory (ru_maxrss) of a stage is its own.
+### Results are written as JSON with the git commit of the timed tree, and
+### can be compared with the JSON of another commit (--compare).
+###
+### Usage example: git worktree add /tmp/base <commit>
+###   python benchmarks/bench_pipeline.py --repo /tmp/base --json BASE.json
+###   python benchmarks/bench_pipeline.py --scales 100000 1000000 --json HEAD.json --compare BASE.json
+#############################################################################
+
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from synthetic import makeRunFolder
+
+#############################################################################
+# Variables
+#############################################################################
+STAGES={'clean': 'sortUndetermined_bcl2fastq.12.py', 'tiles': 'sortReadsPerTIle.py'}
+UNDETERMINED_READS=('R1', 'R2', 'I1', 'I2')
+# lines of the output of a failed stage reported
+ERROR_LINES=5
+
+#############################################################################
+# Functions
+#############################################################################
+def listRunFolder( run_dir ):
+    """
+    Returns the set of paths of the run folder run_dir and all its files and folders.
+    """
+    paths={run_dir}
+    for (folder, folders, files) in os.walk(run_dir):
+        paths.update(os.path.join(folder, i) for i in folders+files)
+    return(paths)
+
+def resetRunFolder( run_dir, generated ):
+    """
+    Removes every file and folder of run_dir that is not in generated (see listRunFolder): indexes, cleaned fastqs, tile files,
+    manifests and caches of any commit, so that every stage starts from the run folder as it was generated.
+    """
+    for path in sorted(listRunFolder(run_dir)-generated):
+        if not os.path.lexists(path):
+            continue
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+def runStage( stage, conf_file, repo, extra_args=(), verbose=False ):
+    """
+    Runs the script of stage (see STAGES) of the tree repo on conf_file in a fresh process, with extra_args.
+    Returns a dict with its elapsed time and peak memory, or with its exit status and the end of its output if it failed.
+    """
+    command=[sys.executable, os.path.join(repo, STAGES[stage]), conf_file]+list(extra_args)
+    with tempfile.TemporaryFile() as output:
+        st=time.perf_counter()
+        process=subprocess.Popen(command, cwd=repo, stdout=None if verbose else output, stderr=subprocess.STDOUT)
+        (pid, status, usage)=os.wait4(process.pid, 0)
+        elapsed=time.perf_counter()-st
+        process.returncode=os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            output.seek(0)
+            return({'exit': process.returncode, 'error': output.read().decode(errors='replace').strip().splitlines()[-ERROR_LINES:]})
+    return({'seconds': elapsed, 'peak_rss_mb': usage.ru_maxrss/1024})
+
+def stageReads( stage, summary ):
+    """
+    Returns the number of fastq records read by a stage of a run folder made by makeRunFolder.
+    """
+    if stage == 'clean':
+        return(summary['project_reads']+summary['undetermined_reads']*len(UNDETERMINED_READS))
+    return(summary['project_reads'])
+
+def gitCommit( repo ):
+    """
+    Returns the git commit of the tree repo, with '-dirty' if it has uncommitted changes, or 'unknown'.
+    """
+    try:
+        commit=subprocess.run(['git', '-C', repo, 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty=subprocess.run(['git', '-C', repo, 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return('unknown')
+    return(commit+('-dirty' if dirty else ''))
+
+def compareResults( results, baseline ):
+    """
+    Prints the speedup and memory ratio of results against baseline results (both as written by --json), per scale and stage.
+    Stages that failed in either are skipped.
+    """
+    old={(i['reads'], i['stage']): i for i in baseline['results'] if 'seconds' in i}
+    print("\nCompared with %s:" % baseline['commit'])
+    print("%-10s %-8s %10s %10s %8s %9s" % ('reads', 'stage', 'old_s', 'new_s', 'speedup', 'rss_ratio'))
+    for i in results['results']:
+        j=old.get((i['reads'], i['stage']))
+        if j is None or 'seconds' not in i:
+            continue
+        print("%-10d %-8s %10.3f %10.3f %8.2f %9.2f" % (i['reads'], i['stage'], j['seconds'], i['seconds'],
+              j['seconds']/max(i['seconds'], 1e-9), i['peak_rss_mb']/max(j['peak_rss_mb'], 1e-9)))
+
+#############################################################################
+#                                      MAIN
+#############################################################################
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Benchmarks the DEMUX scripts on synthetic run folders.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[20000, 200000], help='Project reads per lane of each run folder (default: 20000 200000).')
+    parser.add_argument('--lanes', type=int, default=2, help='Lanes per run folder (default: 2).')
+    parser.add_argument('--tiles', type=int, default=8, help='Tiles per lane (default: 8).')
+    parser.add_argument('--overlap', type=float, default=0.5, help='Fraction of Undetermined reads attributed to projects (default: 0.5).')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES), help='Stages to run (default: all, in order).')
+    parser.add_argument('--repeat', type=int, default=1, help='Repetitions per stage, the fastest is kept (default: 1).')
+    parser.add_argument('--repo', default=ROOT, help='Tree whose scripts are timed, e.g. a git worktree of another commit (default: this repository).')
+    parser.add_argument('--clean-args', default='', help='Extra arguments of the clean script, given as --clean-args="-j 8" (default: none).')
+    parser.add_argument('--tiles-args', default='', help='Extra arguments of the tiles script, given as --tiles-args="--stream" (default: none).')
+    parser.add_argument('--workdir', help='Folder for the run folders (default: a temporary folder, removed at the end).')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the stages.')
+    parser.add_argument('--json', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON results of another commit to compare with.')
+    args=parser.parse_args()
+
+    repo=os.path.abspath(args.repo)
+    stages=[i for i in STAGES if i in args.stages]
+    extra_args={'clean': shlex.split(args.clean_args), 'tiles': shlex.split(args.tiles_args)}
+    workdir=args.workdir or tempfile.mkdtemp(prefix='bench_pipeline_')
+    results={'commit': gitCommit(repo), 'date': time.strftime('%Y/%m/%d %H:%M:%S'), 'python': platform.python_version(),
+             'machine': platform.machine(), 'cpus': os.cpu_count(),
+             'params': {'lanes': args.lanes, 'tiles': args.tiles, 'overlap': args.overlap, 'repeat': args.repeat,
+                        'clean_args': args.clean_args, 'tiles_args': args.tiles_args}, 'results': []}
+    print("%-10s %-8s %10s %12s %11s" % ('reads', 'stage', 'seconds', 'reads_per_s', 'peak_rss_mb'))
+    try:
+        for reads in args.scales:
+            run_dir=os.path.join(workdir, 'run_%d' % reads)
+            shutil.rmtree(run_dir, ignore_errors=True)
+            summary=makeRunFolder(run_dir, reads=reads, lanes=args.lanes, tiles=args.tiles, overlap=args.overlap)
+            generated=listRunFolder(run_dir)
+            for stage in stages:
+                runs=[]
+                for _ in range(args.repeat):
+                    resetRunFolder(run_dir, generated)
+                    runs.append(runStage(stage, summary['conf_file'], repo, extra_args[stage], args.verbose))
+                failed=[i for i in runs if 'exit' in i]
+                if failed:
+                    row={'reads': reads, 'stage': stage, 'exit': failed[0]['exit'], 'error': failed[0]['error']}
+                    results['results'].append(row)
+                    print("%-10d %-8s failed with exit status %d:\n  %s" % (reads, stage, row['exit'], '\n  '.join(row['error'])), flush=True)
+                    continue
+                best=min(runs, key=lambda i: i['seconds'])
+                row={'reads': reads, 'stage': stage, 'input_reads': stageReads(stage, summary), 'seconds': round(best['seconds'], 4),
+                     'reads_per_s': round(stageReads(stage, summary)/best['seconds']),
+                     'peak_rss_mb': round(max(i['peak_rss_mb'] for i in runs), 1)}
+                results['results'].append(row)
+                print("%-10d %-8s %10.3f %12d %11.1f" % (reads, stage, row['seconds'], row['reads_per_s'], row['peak_rss_mb']), flush=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compareResults(results, json.load(f))
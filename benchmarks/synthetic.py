@@ -0,0 +1,154 @@
+#############################################################################
+### Synthetic Illumina FASTQ data for the benchmarks.
+###
+### makeFastqRecords makes the records of a single FASTQ file;
+### makeRunFolder makes a whole synthetic DEMUX run folder (master_demux.conf,
+### Unaligned<suffix>/<project> fastqs and Undetermined fastqs that contain a
+### configurable fraction of reads attributed to the projects of the other
+### demultiplexings), as the DEMUX scripts expect it.
+###
+### Usage example: python benchmarks/synthetic.py /scratch/bench --reads 1000000 --lanes 2 --tiles 8 --overlap 0.5
+#############################################################################
+
+import argparse
+import gzip
+import os
+import random
+
+#############################################################################
+# Variables
+#############################################################################
+# demultiplexings of the synthetic run: unaligned suffix -> sample projects
+DEFAULT_PROJECTS={'BCL1': ('ProjA_XX', 'ProjB_YY'), 'BCL2': ('ProjC_ZZ',)}
+QUAL_CHARS='FFFFFFF:,#'
+
+#############################################################################
+# Functions
+#############################################################################
+def makeFastqRecords( n_reads, lane=1, tiles=(1101, 1102, 2101, 2102), read_length=151, read_number=1, seed=0 ):
+    """
+    Makes n_reads synthetic bcl2fastq FASTQ records of lane lane spread over tiles, sorted by tile as bcl2fastq writes them.
+    Returns the records as bytes.
+    Usage example: makeFastqRecords( n_reads = 100000, lane = 1, read_length = 151 )
+    """
+    rng=random.Random(seed)
+    per_tile=-(-n_reads // len(tiles))
+    records=[]
+    for tile in tiles:
+        for _ in range(min(per_tile, n_reads-len(records))):
+            seq=''.join(rng.choices('ACGT', k=read_length))
+            qual=''.join(rng.choices(QUAL_CHARS, k=read_length))
+            records.append('@A00123:45:HXXXXXXXX:%d:%d:%d:%d %d:N:0:ACGTACGT+TTGCAGGA\n%s\n+\n%s\n' % (
+                lane, tile, rng.randint(1000, 32000), rng.randint(1000, 37000), read_number, seq, qual))
+    return(''.join(records).encode())
+
+def makeTileNumbers( n_tiles ):
+    """
+    Returns n_tiles NovaSeq-like tile numbers: 1101, 1102, ... up to 50 tiles per surface, then 2101, ...
+    Usage example: makeTileNumbers( n_tiles = 8 )
+    """
+    return([(1 + i // 50) * 1000 + 101 + i % 50 for i in range(n_tiles)])
+
+def makeCoordinates( n_reads, tiles, rng ):
+    """
+    Makes n_reads distinct (tile, x, y) read coordinates spread over tiles. Returns them sorted by tile, in random order within a tile.
+    Usage example: makeCoordinates( n_reads = 1000, tiles = [1101, 1102], rng = random.Random(0) )
+    """
+    coords=set()
+    while len(coords) < n_reads:
+        coords.add((rng.choice(tiles), rng.randint(1000, 32000), rng.randint(1000, 37000)))
+    coords=list(coords)
+    rng.shuffle(coords)
+    coords.sort(key=lambda c: c[0])
+    return(coords)
+
+def writeFastq( file, lane, coords, read_number, read_length, rng, compresslevel=1 ):
+    """
+    Writes one synthetic FASTQ.GZ record per read coordinate (tile, x, y) of coords, in that order. Sequences and qualities are
+    slices of a random pool, so that large files are made quickly.
+    Usage example: writeFastq( file = 'S1_S1_L001_R1_001.fastq.gz', lane = 1, coords = [(1101, 1000, 2000)], read_number = 1, read_length = 151, rng = random.Random(0) )
+    """
+    pool_size=1 << 16
+    seqs=''.join(rng.choices('ACGT', k=pool_size+read_length))
+    quals=''.join(rng.choices(QUAL_CHARS, k=pool_size+read_length))
+    with gzip.open(file, 'wt', compresslevel=compresslevel) as fq:
+        for start in range(0, len(coords), 100000):
+            block=[]
+            for (tile, x, y) in coords[start:start+100000]:
+                o=rng.randrange(pool_size)
+                block.append('@A00123:45:HXXXXXXXX:%d:%d:%d:%d %d:N:0:ACGTACGT+TTGCAGGA\n%s\n+\n%s\n' % (
+                    lane, tile, x, y, read_number, seqs[o:o+read_length], quals[o:o+read_length]))
+            fq.write(''.join(block))
+
+def makeRunFolder( run_dir, reads=100000, lanes=2, tiles=4, overlap=0.5, undetermined_fraction=0.5, read_length=151, index_length=10,
+                   projects=None, undetermined_reads=('R1', 'R2', 'I1', 'I2'), seed=0 ):
+    """
+    Makes a synthetic DEMUX run folder in run_dir (created if needed):
+    - master_demux.conf declaring one [DEMUX] per unaligned suffix of projects (default DEFAULT_PROJECTS);
+    - Unaligned<suffix>/<project>/<project>_S<n>_L00<lane>_R1_001.fastq.gz: reads reads per lane, split evenly between all projects;
+    - Unaligned<suffix>/Undetermined/Undetermined_S0_L00<lane>_<read>_001.fastq.gz for every read of undetermined_reads, with
+      reads*undetermined_fraction reads per lane, of which the fraction overlap are reads of the projects of the other demultiplexings
+      (the reads removed by cleaning) and the rest reads of no project.
+    Reads are spread over tiles tiles per lane. Returns a dict with the path of master_demux.conf and the number of reads written.
+    Usage example: makeRunFolder( run_dir = '/scratch/bench/RUN', reads = 1000000, lanes = 2, tiles = 8, overlap = 0.5 )
+    """
+    rng=random.Random(seed)
+    projects=projects or DEFAULT_PROJECTS
+    tile_numbers=makeTileNumbers(tiles)
+    os.makedirs(run_dir, exist_ok=True)
+    conf_file=os.path.join(run_dir, 'master_demux.conf')
+    with open(conf_file, 'w') as conf:
+        for (suffix, project_list) in projects.items():
+            conf.write('[DEMUX]\nunaligned_suffix=%s\nOverrideCycles=Y%d;I%d;I%d;Y%d\nBarcodeMismatchesIndex1=1\nsample_project=%s\n\n' % (
+                suffix, read_length, index_length, index_length, read_length, ','.join(project_list)))
+
+    project_paths=[(suffix, project) for (suffix, project_list) in projects.items() for project in project_list]
+    n_undetermined=int(reads*undetermined_fraction)
+    n_overlap=int(n_undetermined*overlap)
+    summary={'conf_file': conf_file, 'project_reads': 0, 'undetermined_reads': 0, 'overlap_reads': 0}
+    for lane in range(1, lanes+1):
+        # distinct coordinates for the project reads and the real Undetermined reads of every demultiplexing
+        coords=makeCoordinates(reads+len(projects)*(n_undetermined-n_overlap), tile_numbers, rng)
+        rng.shuffle(coords)
+        assigned={}
+        for (n, (suffix, project)) in enumerate(project_paths):
+            assigned[(suffix, project)]=sorted(coords[n*reads//len(project_paths):(n+1)*reads//len(project_paths)], key=lambda c: c[0])
+            path=os.path.join(run_dir, 'Unaligned'+suffix, project)
+            os.makedirs(path, exist_ok=True)
+            writeFastq(os.path.join(path, '%s_S%d_L%03d_R1_001.fastq.gz' % (project, n+1, lane)), lane, assigned[(suffix, project)], 1, read_length, rng)
+            summary['project_reads']+=len(assigned[(suffix, project)])
+        unassigned=coords[reads:]
+        for (n, suffix) in enumerate(projects):
+            others=[c for (key, cs) in assigned.items() if key[0] != suffix or len(projects) == 1 for c in cs]
+            undetermined=rng.sample(others, min(n_overlap, len(others)))+unassigned[n*(n_undetermined-n_overlap):(n+1)*(n_undetermined-n_overlap)]
+            rng.shuffle(undetermined)
+            undetermined.sort(key=lambda c: c[0])
+            path=os.path.join(run_dir, 'Unaligned'+suffix, 'Undetermined')
+            os.makedirs(path, exist_ok=True)
+            for (read_number, read) in enumerate(undetermined_reads, start=1):
+                length=index_length if read.startswith('I') else read_length
+                writeFastq(os.path.join(path, 'Undetermined_S0_L%03d_%s_001.fastq.gz' % (lane, read)), lane, undetermined, read_number, length, rng)
+            summary['undetermined_reads']+=len(undetermined)
+            summary['overlap_reads']+=min(n_overlap, len(others))
+    return(summary)
+
+#############################################################################
+#                                      MAIN
+#############################################################################
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Makes a synthetic DEMUX run folder for the benchmarks.')
+    parser.add_argument('run_dir', help='Run folder to create.')
+    parser.add_argument('--reads', type=int, default=100000, help='Project reads per lane (default: 100000).')
+    parser.add_argument('--lanes', type=int, default=2, help='Number of lanes, at most 4 (default: 2).')
+    parser.add_argument('--tiles', type=int, default=4, help='Number of tiles per lane (default: 4).')
+    parser.add_argument('--overlap', type=float, default=0.5, help='Fraction of Undetermined reads attributed to projects (default: 0.5).')
+    parser.add_argument('--undetermined-fraction', type=float, default=0.5, help='Undetermined reads per demultiplexing and lane, as a fraction of --reads (default: 0.5).')
+    parser.add_argument('--read-length', type=int, default=151, help='Read length (default: 151).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0).')
+    args=parser.parse_args()
+
+    summary=makeRunFolder(args.run_dir, reads=args.reads, lanes=args.lanes, tiles=args.tiles, overlap=args.overlap,
+                          undetermined_fraction=args.undetermined_fraction, read_length=args.read_length, seed=args.seed)
+    for k, v in summary.items():
+        print("%-20s %s" % (k, v))
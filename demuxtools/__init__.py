@@ -0,0 +1,22 @@
+#############################################################################
+### The DEMUX tools, run as python -m demuxtools <command> or through the
+### scripts sortUndetermined_bcl2fastq.12.py (clean) and sortReadsPerTIle.py
+### (tiles).
+###
+### cli       : command line, subcommands clean, tiles, batch and layout
+### clean     : cleaning of the Undetermined fastqs of a run
+### batch     : cleaning of many runs on one worker pool within a memory budget
+### tiles     : read coordinates of the Unaligned projects per tile
+### coordindex: packed read coordinates and on-disk lane indexes
+### pipeline  : threaded read -> filter -> write pipeline with per-stage statistics
+### tilestore : memory-mapped per-tile read coordinate store with a query API
+### layout    : run layout parsed from master_demux.conf, file index and folder listing cache
+### fastqio   : pluggable compression layer for all FASTQ I/O
+### scanner   : header-only FASTQ read-coordinate scanner
+### manifest  : checkpoint manifest and atomic outputs for resumable runs
+### metrics   : phase timers, throughput, peak RSS and cProfile dumps as JSON lines
+### log       : log messages
+###
+### Submodules are not imported here: importing the package is cheap, and
+### NumPy and Biopython are only loaded by the commands that need them.
+#############################################################################
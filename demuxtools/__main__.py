@@ -0,0 +1,9 @@
+#############################################################################
+### python -m demuxtools <command> ...   (see demuxtools.cli)
+#############################################################################
+
+import sys
+
+from demuxtools.cli import main
+
+sys.exit(main())
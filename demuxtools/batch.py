@@ -0,0 +1,226 @@
+#############################################################################
+### Batch cleaning of many DEMUX runs on one node (command: batch).
+###
+### The lanes of all runs are scheduled onto one pool of worker processes.
+### The memory of the workers themselves (see workerMemory) is taken from a
+### global memory budget first; every lane then reserves an estimate of the
+### memory of its coordinate index (see estimateLaneMemory) from what is left
+### while its index is built and its Undetermined fastqs are cleaned. A lane
+### is started only when its reservation fits, the largest lanes first, so
+### that a large lane and several small ones share the node without running
+### out of memory. A lane whose index cannot fit in the budget at all is
+### cleaned with external sorting and merge-join within it (see clean_fastq,
+### max_memory).
+###
+### A throughput summary is printed and recorded per run.
+#############################################################################
+
+import multiprocessing
+import os
+import sys
+import time
+
+from demuxtools.clean import (collectLaneTasks, initWorker, buildLaneIndex, cleanUndeterminedWorker, groupUndeterminedReads,
+                              checkWorkers, MANIFEST_NAME)
+from demuxtools.coordindex import prefilter
+from demuxtools.fastqio import compression
+from demuxtools.layout import loadRunLayout
+from demuxtools.log import printMsg
+from demuxtools.manifest import Manifest
+from demuxtools.metrics import metrics, recordMetrics
+from demuxtools.pipeline import pipeline
+
+#############################################################################
+# Variables
+#############################################################################
+CONFIG_NAME='master_demux.conf'
+# folders of a run that are never searched for config files
+SKIPPED_FOLDERS=('Unaligned', 'Undetermined', 'perTileReadsTMP')
+# memory estimate of a lane index: project R1 fastq.gz bytes per read (low, to overestimate reads) and bytes per read while the index is built
+GZ_BYTES_PER_READ=50
+INDEX_BYTES_PER_READ=32
+# seconds between two checks of the running lanes
+POLL_INTERVAL=0.2
+# resident memory of a worker process without its record batches (Python, NumPy, demuxtools, (de)compression buffers):
+# about 45 MB measured, with a margin; see --worker-memory
+WORKER_BASE_MEMORY=64 << 20
+# memory of a record of a batch: the parsed (title, seq, qual) strings and the output text, measured for 151 bp reads
+RECORD_MEMORY=1280
+# read files cleaned together by a worker at most with lockstep (R1, R2, R3, I1, I2)
+LOCKSTEP_READS=5
+# smallest memory a worker cleaning a lane with external sorting is given
+MIN_SORT_MEMORY=1 << 20
+
+#############################################################################
+# Functions
+#############################################################################
+def discoverConfigs( paths, max_depth=2 ):
+    """
+    Returns the sorted absolute paths of the config files of paths: config files are taken as they are, folders (e.g. a DEMUX root)
+    are searched for CONFIG_NAME files up to max_depth folders down, without entering Unaligned, Undetermined or hidden folders.
+    Usage example: discoverConfigs( paths = ['/work/.../DEMUX', '/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf'] )
+    """
+    config_files=set()
+    for path in paths:
+        if os.path.isfile(path):
+            config_files.add(os.path.abspath(path))
+        elif os.path.isdir(path):
+            folders=[(path, 0)]
+            while folders:
+                (folder, depth)=folders.pop()
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.name == CONFIG_NAME and entry.is_file():
+                            config_files.add(os.path.abspath(entry.path))
+                        elif (depth < max_depth and entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.')
+                              and not entry.name.startswith(SKIPPED_FOLDERS)):
+                            folders.append((entry.path, depth+1))
+        else:
+            sys.exit("[FATAL] "+path+" is neither a config file nor a folder.")
+    if not config_files:
+        sys.exit("[FATAL] No "+CONFIG_NAME+" found in "+', '.join(paths)+".")
+    return(sorted(config_files))
+
+def formatMB( size ):
+    """
+    Returns a size in bytes as megabytes with one decimal, e.g. '1.5 MB'.
+    Usage example: formatMB( size = 3<<19 )
+    """
+    return(str(round(size/(1<<20), 1))+" MB")
+
+def workerMemory( base_memory=WORKER_BASE_MEMORY, lockstep=False ):
+    """
+    Returns the memory in bytes a worker process takes besides the lane indexes: base_memory plus its record batches with the configured
+    batch size (see configurePipeline), i.e. one batch, depth+2 batches with the pipeline enabled (depth in each queue and one in the
+    filter, reader or writer) or one batch per read file cleaned together with lockstep (see LOCKSTEP_READS).
+    Usage example: workerMemory( base_memory = 64<<20, lockstep = True )
+    """
+    if lockstep:
+        batches=LOCKSTEP_READS
+    else:
+        batches=pipeline['depth']+2 if pipeline['enabled'] else 1
+    return(base_memory+batches*pipeline['batch_size']*RECORD_MEMORY)
+
+def capWorkers( jobs, memory_budget=None, worker_memory=WORKER_BASE_MEMORY ):
+    """
+    Returns the number of worker processes to use within memory_budget (bytes, None for no budget): at most jobs, and few enough that
+    every worker gets worker_memory (see workerMemory) plus MIN_SORT_MEMORY to clean a lane with external sorting, so that the workers
+    together stay within the budget. Raises ValueError if the budget cannot fit one worker.
+    Usage example: capWorkers( jobs = 16, memory_budget = 8<<30, worker_memory = workerMemory() )
+    """
+    if memory_budget is None:
+        return(jobs)
+    if memory_budget < worker_memory+MIN_SORT_MEMORY:
+        raise ValueError("The memory budget ("+formatMB(memory_budget)+") cannot fit one worker process, which needs "+
+                         formatMB(worker_memory+MIN_SORT_MEMORY)+" (see --worker-memory and --batch-size).")
+    workers=min(jobs, memory_budget//(worker_memory+MIN_SORT_MEMORY))
+    if workers < jobs:
+        printMsg("Memory budget of "+formatMB(memory_budget)+" too small for "+str(jobs)+" workers: using "+str(workers)+" worker processes.")
+    return(workers)
+
+def estimateLaneMemory( L_read1_file_list ):
+    """
+    Returns an estimate in bytes of the memory needed to build and hold the in-memory coordinate index of a lane (see makeSet2Eliminate),
+    from the size of its project R1 fastq.gz files.
+    Usage example: estimateLaneMemory( L_read1_file_list = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'] )
+    """
+    return(sum(os.path.getsize(i) for i in L_read1_file_list)//GZ_BYTES_PER_READ*INDEX_BYTES_PER_READ)
+
+def planLanes( config_files, jobs, memory_budget=None, max_memory=None, lockstep=False, resume=True, verify=False, lanes=None, resident_tiles=None ):
+    """
+    Collects the lanes of all runs of config_files (see collectLaneTasks) with the memory they reserve from memory_budget (bytes, None for no budget),
+    the memory left to the lanes once the worker processes are accounted for (see cleanRuns): the estimated index memory (see estimateLaneMemory),
+    or max_memory per worker cleaning the lane at once if max_memory is set. A lane whose reservation exceeds memory_budget reserves all of it
+    and is cleaned with max_memory=memory_budget/jobs per worker instead (at least MIN_SORT_MEMORY, see capWorkers).
+    Returns a tuple with the list of runs (dicts with the config file and checkpoint manifest) and the list of lanes (dicts), largest reservation first.
+    Usage example: planLanes( config_files = discoverConfigs(['/work/.../DEMUX']), jobs = 8, memory_budget = 64<<30 )
+    """
+    (runs, lane_plans)=([], [])
+    for config_file in config_files:
+        layout=loadRunLayout(config_file)
+        runs.append({'config_file': config_file, 'manifest': Manifest(layout.runFile(MANIFEST_NAME), verify=verify, resume=resume)})
+        for (L, L_read1_file_list, headers_file, fq_list) in collectLaneTasks(layout, lanes, resident_tiles):
+            tasks=len(groupUndeterminedReads(fq_list)) if lockstep else len(fq_list)
+            lane_max_memory=max_memory
+            memory=max_memory*max(min(jobs, tasks), 1) if max_memory else estimateLaneMemory(L_read1_file_list)
+            if memory_budget is not None and memory > memory_budget:
+                printMsg("Estimated memory of lane "+L+" of "+config_file+" ("+formatMB(memory)+") exceeds the budget: cleaning it with external sorting.")
+                (lane_max_memory, memory)=(memory_budget//jobs, memory_budget)
+            lane_plans.append({'run': len(runs)-1, 'lane': L, 'read1_files': L_read1_file_list, 'index_file': headers_file, 'fastqs': fq_list,
+                               'memory': memory, 'max_memory': lane_max_memory})
+    lane_plans.sort(key=lambda i: -i['memory'])
+    return(runs, lane_plans)
+
+def cleanRuns( config_files, jobs=1, memory_budget=None, max_memory=None, lockstep=False, resume=True, verify=False, lanes=None, resident_tiles=None,
+               worker_memory=WORKER_BASE_MEMORY ):
+    """
+    Cleans the Undetermined fastqs of all runs of config_files with one pool of jobs worker processes (fewer if memory_budget is too small
+    for them, see capWorkers). memory_budget (bytes, None for no budget) covers the worker processes, each taking worker_memory plus its
+    record batches (see workerMemory), and the lanes: lanes of all runs are started as soon as their memory reservation fits in what the
+    workers leave (see planLanes), the largest first; every lane index is built
+    by one worker and the Undetermined fastqs of the lane are then cleaned by all workers (see clean_fastq_parallel). max_memory, lockstep,
+    resume, verify, lanes and resident_tiles apply to every run as for clean_fastq. Raises ChildProcessError if a worker process dies (see checkWorkers).
+    A throughput summary of every run is printed and recorded as a 'batchRun' metrics event (see summarizeRun). Returns the list of summaries.
+    Usage example: cleanRuns( config_files = discoverConfigs(['/work/.../DEMUX']), jobs = 16, memory_budget = 64<<30 )
+    """
+    worker_memory=workerMemory(worker_memory, lockstep)
+    jobs=capWorkers(jobs, memory_budget, worker_memory)
+    lane_budget=memory_budget-jobs*worker_memory if memory_budget is not None else None
+    (runs, pending)=planLanes(config_files, jobs, lane_budget, max_memory, lockstep, resume, verify, lanes, resident_tiles)
+    printMsg("Cleaning "+str(len(pending))+" lanes of "+str(len(runs))+" runs with "+str(jobs)+" worker processes"+
+             (" within a memory budget of "+formatMB(memory_budget)+": "+formatMB(worker_memory)+" per worker, "+formatMB(lane_budget)+
+              " for the lane indexes." if memory_budget is not None else "."))
+    for run in runs:
+        run.update(lanes=0, start=None, end=None, **dict.fromkeys(('files', 'skipped', 'reads', 'kept', 'in_bytes'), 0))
+    (building, cleaning, reserved)=({}, {}, 0)
+    with multiprocessing.Pool(processes=jobs, initializer=initWorker, initargs=(dict(compression), dict(metrics), dict(prefilter), dict(pipeline))) as pool:
+        workers=multiprocessing.active_children()
+        while pending or building or cleaning:
+            checkWorkers(workers)
+            # start the lanes that fit in the budget; one lane at least
+            for lane in list(pending):
+                if lane_budget is None or reserved+lane['memory'] <= lane_budget or not (building or cleaning):
+                    pending.remove(lane)
+                    reserved+=lane['memory']
+                    run=runs[lane['run']]
+                    run['start']=run['start'] or time.time()
+                    building[id(lane)]=(lane, pool.apply_async(buildLaneIndex, (lane['lane'], lane['read1_files'], lane['index_file'], lane['max_memory'], resident_tiles)))
+            # clean the lanes whose index is built
+            for (key, (lane, result)) in list(building.items()):
+                if result.ready():
+                    index_file=result.get()
+                    manifest=runs[lane['run']]['manifest']
+                    undet_list=[sorted(i.values()) for i in groupUndeterminedReads(lane['fastqs']).values()] if lockstep else sorted(lane['fastqs'])
+                    cleaning[key]=(lane, [pool.apply_async(cleanUndeterminedWorker, (index_file, undet_FQ, lane['max_memory'], lockstep, manifest, resident_tiles))
+                                          for undet_FQ in undet_list])
+                    del building[key]
+            # release the memory of the lanes that are done
+            for (key, (lane, results)) in list(cleaning.items()):
+                if all(i.ready() for i in results):
+                    run=runs[lane['run']]
+                    for totals in (i.get() for i in results):
+                        for i in totals:
+                            run[i]+=totals[i]
+                    run['lanes']+=1
+                    run['end']=time.time()
+                    reserved-=lane['memory']
+                    del cleaning[key]
+                    printMsg("Lane "+lane['lane']+" of "+run['config_file']+" done.")
+            time.sleep(POLL_INTERVAL)
+    return([summarizeRun(run) for run in runs])
+
+def summarizeRun( run ):
+    """
+    Prints and records as a 'batchRun' metrics event the throughput summary of a run cleaned by cleanRuns: lanes, files cleaned and skipped,
+    reads read and kept, input bytes, and reads/s and MB/s over the time from the start of its first lane to the end of its last. Returns the summary.
+    Usage example: summarizeRun( run = {'config_file': 'master_demux.conf', 'lanes': 4, 'files': 16, 'skipped': 0, 'reads': 10**9, 'kept': 10**8, 'in_bytes': 50<<30, 'start': 0, 'end': 3600} )
+    """
+    seconds=round((run['end'] or 0)-(run['start'] or 0), 4)
+    summary={i: run[i] for i in ('config_file', 'lanes', 'files', 'skipped', 'reads', 'kept', 'in_bytes')}
+    summary.update(seconds=seconds, reads_per_s=round(run['reads']/seconds, 1) if seconds > 0 else None,
+                   bytes_per_s=round(run['in_bytes']/seconds, 1) if seconds > 0 else None)
+    printMsg("Run "+run['config_file']+": "+str(run['lanes'])+" lanes, "+str(run['files'])+" files cleaned ("+str(run['skipped'])+" already done), "+
+             str(run['reads'])+" reads ("+str(run['kept'])+" kept) in "+str(round(seconds/60, 1))+" minutes"+
+             (": "+str(round(summary['reads_per_s']))+" reads/s, "+str(round(summary['bytes_per_s']/(1<<20), 1))+" MB/s." if seconds > 0 else "."))
+    recordMetrics('batchRun', **summary)
+    return(summary)
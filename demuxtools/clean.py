@@ -0,0 +1,618 @@
+#############################################################################
+### Cleaning of the Undetermined fastqs of a DEMUX run (command: clean).
+###
+### Removes from every Undetermined fastq.gz the reads that were attributed
+### to a sample project by any demultiplexing of the run: the read
+### coordinates of the project R1 fastqs of a lane are collected in a
+### coordinate index (see demuxtools.coordindex) and every Undetermined
+### fastq of the lane is filtered against it into Undetermined_clean.
+#############################################################################
+
+import multiprocessing
+import os
+import re
+import shutil
+import time
+from array import array
+from contextlib import ExitStack
+from datetime import datetime as dt
+from itertools import islice
+
+import numpy as np
+
+from demuxtools.coordindex import (packCoordinateArrays, makeCoordIndex, writeCoordIndex, isCoordIndexStale,
+                                   loadCoordIndex, inCoordIndex, spillSortedRun, writeCoordIndexFromRuns, mergeJoinCoordIndex,
+                                   groupByTile, isShardedIndexStale, ShardedCoordIndex, SHARD_SUFFIX, readCoordIndexHeader,
+                                   configurePrefilter, prefilter, prefilter_stats)
+from demuxtools.fastqio import openFastq, fastqRecords, configureCompression, compression
+from demuxtools.layout import loadRunLayout, LANES, READ1_PATTERN
+from demuxtools.manifest import Manifest, atomicPath, PARTIAL_SUFFIX
+from demuxtools.metrics import configureMetrics, metrics, phase
+from demuxtools.pipeline import configurePipeline, pipeline, batchRecords, runPipeline
+from demuxtools.scanner import scanReadCoordinates, parseTitleCoordinates
+from demuxtools.tiles import TileWriterPool
+
+#############################################################################
+# Variables
+#############################################################################
+# read tag of an Undetermined fastq name, e.g. Undetermined_S0_L001_R1_001.fastq.gz
+READ_TAG=re.compile(r'_(R[1-3]|I[12])_(\d{3}\.fastq\.gz)$')
+# checkpoint manifest of the cleaned Undetermined fastqs, in the DEMUX_RUN directory
+MANIFEST_NAME='cleanUndetermined.manifest.json'
+# seconds between two checks of the worker processes while waiting for a result
+WORKER_POLL_INTERVAL=0.5
+
+#############################################################################
+# Functions
+#############################################################################
+def makeSet2Eliminate( folder_path_list, lane_pattern, output_file ):
+    """
+    Makes a sorted index of packed read coordinates (see makeCoordIndex) from the fastq files present in the list folder_paths that match the wanted read pattern (R1, R2, R3 or I1, I2).
+    The index is saved to the binary index file output_file (see writeCoordIndex) and reused on reruns, unless the source fastq files changed.
+    With a prefilter configured (see configurePrefilter), the index is returned memory-mapped with its prefilter and the estimated false-positive rate is reported.
+    Usage example: clean_fastq( folder_path_list = ['/home/myUnalignedPath1', '/home/myUnalignedPath2'] , lane_pattern = 'L001' , read_pattern = '*_R1_*' , output_file = "read_coordinates2remove.idx" )
+    """
+    if not isCoordIndexStale(output_file, folder_path_list):
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Index file \n\n",output_file,"\n\nalready exists and is up to date with its source fastq files. Memory-mapping unwanted read coordinates.\n", sep="")
+        unwanted_set=loadCoordIndex(output_file)
+        print("\n[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Done loading ", len(unwanted_set), " read coordinates from index file.\n", sep="")
+        reportPrefilter([output_file])
+    else:
+        if os.path.exists(output_file):
+            print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Index file ",output_file," is stale or invalid and will be rebuilt.\n", sep="")
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Processing the following project fastq files from lane ", lane_pattern, " to extract headers of reads to be eliminated from the Undetermined fastq files.","\n", sep="")
+        with phase('index', lane=lane_pattern, index_file=output_file) as counters:
+            packed=process_unal_fq_files_xtract_headers(L_read1_file_list=folder_path_list)
+            print("\n[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Done extracting read coordinates for ", lane_pattern,".\n", sep="")
+            unwanted_set=makeCoordIndex(packed)
+            counters.update(reads=len(packed), coordinates=len(unwanted_set), in_bytes=sum(os.path.getsize(i) for i in folder_path_list))
+            del packed
+            writeCoordIndex(output_file, unwanted_set, folder_path_list)
+        print("\n[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Done making index of ", len(unwanted_set), " read coordinates to be eliminated for ", lane_pattern, ": ", output_file, "\n", sep="")
+        if prefilter['bits_per_key']:
+            # test reads against the prefilter saved with the index
+            unwanted_set=loadCoordIndex(output_file)
+            reportPrefilter([output_file])
+    return(unwanted_set)
+
+def process_unal_fq_files_xtract_headers(L_read1_file_list):
+    """
+    Extracts the read coordinates of all reads in the fastq files of L_read1_file_list with the header-only scanner (see demuxtools.scanner).
+    Returns an array('Q') of packed read coordinates.
+    Usage example: process_unal_fq_files_xtract_headers( L_read1_file_list = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'] )
+    """
+    packed=array('Q')
+    for fq in L_read1_file_list:
+        print(fq)
+        for (lane, tile, x, y) in scanReadCoordinates(fq):
+            packed.frombytes(packCoordinateArrays(lane, tile, x, y).tobytes())
+    return(packed)
+
+def cleanUndetermined( headers_set, undetermined_fq, out_file, batch_size=None ):
+    """
+    Uses the coordinate index made by makeSet2Eliminate provided as ARG1 to clean the fastq file goven as ARG2 to output file in ARG3.
+    Reads are tested against the index in batches of batch_size reads (default: the configured batch size, see configurePipeline). Writes the final reads to the out_file.
+    Returns a tuple with the number of reads read and the number of reads kept.
+    Usage example: cleanUndetermined( headers_set = makeSet2Eliminate(...), undetermined_fq = '/home/Undaligned_PROJECT_1/Undetermined/Undetermined_L001_R1_001.fastq.gz',
+    out_file = '/home/Undaligned_PROJECT_1/Undetermined/Undetermined_clean.fastq.gz' )
+    """
+    with openFastq(undetermined_fq,"rt") as undet_handle, openFastq(out_file,"wt") as out_handle:
+        # go over Undetermined fastq headers read positions; pick those that do not match the headers_set and write to out_file
+        return(cleanRecords(fastqRecords(undet_handle), lambda batch: filterCleanBatch(headers_set, batch), out_handle, batch_size, undetermined_fq))
+    #return(print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] CleanUndetermined completed.","\n", sep=""))
+
+def cleanRecords( records, filter_batch, out_handle, batch_size=None, name='' ):
+    """
+    Cleans an iterator of (title, seq, qual) records in batches of batch_size (default: the configured batch size): filter_batch returns the text
+    of the kept records of a batch and their number, and the text is written to out_handle in order. With the pipeline enabled (see configurePipeline),
+    batches are read, filtered and written at the same time by threads connected by bounded queues (see runPipeline), name being the file reported.
+    Returns a tuple with the number of reads read and the number of reads kept.
+    Usage example: cleanRecords( records = fastqRecords(undet_handle), filter_batch = lambda batch: filterCleanBatch(headers_set, batch), out_handle = out_handle )
+    """
+    counts={'reads': 0, 'kept': 0}
+    def filterBatch( batch ):
+        (text, n_kept)=filter_batch(batch)
+        counts['reads']+=len(batch)
+        counts['kept']+=n_kept
+        return(text)
+    batches=batchRecords(records, batch_size or pipeline['batch_size'])
+    if pipeline['enabled']:
+        runPipeline(batches, filterBatch, out_handle.write, pipeline['depth'], name)
+    else:
+        for batch in batches:
+            out_handle.write(filterBatch(batch))
+    return(counts['reads'], counts['kept'])
+
+def filterCleanBatch( headers_set, batch ):
+    """
+    Selects the reads of a batch of (title, seq, qual) records whose read coordinates are not present in the coordinate index.
+    Returns a tuple with the fastq text of the kept reads and their number.
+    Usage example: filterCleanBatch( headers_set = makeSet2Eliminate(...), batch = [('title', 'ACGT', 'FFFF')] )
+    """
+    packed=packCoordinateArrays(*parseTitleCoordinates([j[0] for j in batch]))
+    # test if read positions present
+    present=inCoordIndex(headers_set, packed)
+    return(''.join("@%s\n%s\n+\n%s\n" % j for j, p in zip(batch, present) if not p), len(batch)-int(np.count_nonzero(present)))
+
+def makeSet2EliminateExternal( folder_path_list, lane_pattern, output_file, max_memory ):
+    """
+    Bounded-memory version of makeSet2Eliminate for lanes whose coordinates do not fit in memory. The packed read coordinates are
+    collected in runs of at most max_memory/2 bytes, each run is sorted, de-duplicated and spilled to a temporary file, and the runs
+    are merged block by block (see mergeSortedRuns) into the same binary index file as makeSet2Eliminate writes.
+    Returns the path of the index file; an up-to-date index file is reused.
+    Usage example: makeSet2EliminateExternal( folder_path_list = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'], lane_pattern = 'L001', output_file = 'L001read_coordinates_to_eliminate.idx', max_memory = 2<<30 )
+    """
+    if not isCoordIndexStale(output_file, folder_path_list):
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Index file \n\n",output_file,"\n\nalready exists and is up to date with its source fastq files.\n", sep="")
+        reportPrefilter([output_file])
+        return(output_file)
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Processing the following project fastq files from lane ", lane_pattern, " with external sorting in runs of ", max_memory//2//8, " read coordinates.","\n", sep="")
+    run_dir=output_file+'.runs'
+    # left over by a killed run
+    if os.path.isdir(run_dir):
+        shutil.rmtree(run_dir)
+    os.mkdir(run_dir)
+    with phase('index', lane=lane_pattern, index_file=output_file, external=True) as counters:
+        run_files=[]
+        run=np.empty(max(max_memory//2//8, 1), dtype=np.uint64)
+        filled=0
+        n_reads=0
+        try:
+            for fq in folder_path_list:
+                print(fq)
+                for (lane, tile, x, y) in scanReadCoordinates(fq):
+                    packed=packCoordinateArrays(lane, tile, x, y)
+                    n_reads+=len(packed)
+                    while len(packed):
+                        n=min(len(packed), len(run)-filled)
+                        run[filled:filled+n]=packed[:n]
+                        filled+=n
+                        packed=packed[n:]
+                        if filled == len(run):
+                            run_files.append(spillSortedRun(run[:filled], run_dir, len(run_files)))
+                            filled=0
+            if filled or not run_files:
+                run_files.append(spillSortedRun(run[:filled], run_dir, len(run_files)))
+            del run
+            print("\n[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Merging ", len(run_files), " sorted runs for ", lane_pattern,".\n", sep="")
+            count=writeCoordIndexFromRuns(output_file, run_files, folder_path_list, max_memory)
+            counters.update(reads=n_reads, coordinates=count, runs=len(run_files), in_bytes=sum(os.path.getsize(i) for i in folder_path_list))
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+    print("\n[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Done making index of ", count, " read coordinates to be eliminated for ", lane_pattern, ": ", output_file, "\n", sep="")
+    reportPrefilter([output_file])
+    return(output_file)
+
+def makeSet2EliminateSharded( folder_path_list, lane_pattern, output_dir, max_memory=None ):
+    """
+    Tile-sharded version of makeSet2Eliminate: the packed read coordinates of the fastq files of folder_path_list are split by tile into
+    one run file per tile (written through a TileWriterPool, buffering at most max_memory/2 bytes if max_memory is set), then every tile
+    is sorted, de-duplicated and saved to its own binary index file <lane>_<tile>.idx in the folder output_dir (see ShardedCoordIndex).
+    Only one tile is held in memory at a time. The folder is written to output_dir.part and renamed when complete; an up-to-date folder is reused.
+    Returns the path of the folder.
+    Usage example: makeSet2EliminateSharded( folder_path_list = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'], lane_pattern = 'L001', output_dir = 'L001read_coordinates_to_eliminate.tiles' )
+    """
+    if not isShardedIndexStale(output_dir, folder_path_list):
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Tile index folder \n\n",output_dir,"\n\nalready exists and is up to date with its source fastq files.\n", sep="")
+        reportPrefilter([os.path.join(output_dir, i) for i in sorted(os.listdir(output_dir)) if i.endswith(SHARD_SUFFIX)])
+        return(output_dir)
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Processing the following project fastq files from lane ", lane_pattern, " to make one index of read coordinates to be eliminated per tile.","\n", sep="")
+    part_dir=output_dir+PARTIAL_SUFFIX
+    if os.path.isdir(part_dir):
+        shutil.rmtree(part_dir)
+    os.mkdir(part_dir)
+    with phase('index', lane=lane_pattern, index_file=output_dir, sharded=True) as counters:
+        tiles=set()
+        n_reads=0
+        with TileWriterPool(part_dir, max_buffered=max_memory//2 if max_memory else 1<<28, binary=True) as tile_files:
+            for fq in folder_path_list:
+                print(fq)
+                for (lane, tile, x, y) in scanReadCoordinates(fq):
+                    packed=packCoordinateArrays(lane, tile, x, y)
+                    n_reads+=len(packed)
+                    for (tt, idx) in groupByTile(packed):
+                        if tt not in tiles:
+                            tiles.add(tt)
+                            tile_files.create(tt+'.u64')
+                        tile_files.write(tt+'.u64', packed[idx].astype('<u8', copy=False).tobytes())
+        count=0
+        for tt in sorted(tiles):
+            run_file=os.path.join(part_dir, tt+'.u64')
+            coord_index=np.unique(np.fromfile(run_file, dtype='<u8'))
+            os.remove(run_file)
+            writeCoordIndex(os.path.join(part_dir, tt+SHARD_SUFFIX), coord_index, folder_path_list)
+            count+=len(coord_index)
+            del coord_index
+        counters.update(reads=n_reads, coordinates=count, tiles=len(tiles), in_bytes=sum(os.path.getsize(i) for i in folder_path_list))
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(part_dir, output_dir)
+    print("\n[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Done making ", len(tiles), " tile indexes of ", count, " read coordinates to be eliminated for ", lane_pattern, ": ", output_dir, "\n", sep="")
+    reportPrefilter([os.path.join(output_dir, tt+SHARD_SUFFIX) for tt in sorted(tiles)])
+    return(output_dir)
+
+def cleanUndeterminedMergeJoin( index_file, undetermined_fq, out_file, max_memory, batch_size=None ):
+    """
+    Bounded-memory version of cleanUndetermined that never loads the lane index: reads are taken in batches of batch_size, the packed
+    coordinates of a batch are sorted and merge-joined with the matching range of the sorted index file, read in windows of at most
+    max_memory/4 bytes. Reads are written in their original order, so the output is the same as with cleanUndetermined.
+    Returns a tuple with the number of reads read and the number of reads kept.
+    Usage example: cleanUndeterminedMergeJoin( index_file = 'L001read_coordinates_to_eliminate.idx', undetermined_fq = '/home/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz',
+    out_file = '/home/Undetermined_clean/Undetermined_clean_S0_L001_R1_001.fastq.gz', max_memory = 2<<30 )
+    """
+    coord_index=loadCoordIndex(index_file)
+    window=max(max_memory//4//8, 4096)
+    with openFastq(undetermined_fq,"rt") as undet_handle, openFastq(out_file,"wt") as out_handle:
+        return(cleanRecords(fastqRecords(undet_handle), lambda batch: filterMergeJoinBatch(coord_index, window, batch), out_handle, batch_size, undetermined_fq))
+
+def filterMergeJoinBatch( coord_index, window, batch ):
+    """
+    Selects the reads of a batch of (title, seq, qual) records that are not in the memory-mapped coord_index (see mergeJoinCoordIndex).
+    Returns a tuple with the fastq text of the kept reads and their number.
+    Usage example: filterMergeJoinBatch( coord_index = loadCoordIndex('L001read_coordinates_to_eliminate.idx'), window = 1<<20, batch = [('title', 'ACGT', 'FFFF')] )
+    """
+    packed=packCoordinateArrays(*parseTitleCoordinates([j[0] for j in batch]))
+    present=mergeJoinCoordIndex(coord_index, window, packed)
+    return(''.join("@%s\n%s\n+\n%s\n" % j for j, p in zip(batch, present) if not p), len(batch)-int(np.count_nonzero(present)))
+
+def clean_fastq( config_file, jobs=1, max_memory=None, lockstep=False, resume=True, verify=False, lanes=None, resident_tiles=None ):
+    """
+    Removes reads from the target Undetermiend FQ.GZ per Demux declared in the config_file for all Undetermined reads (R1, R2, I1, I2, R3) separately.
+    Uses the fastq.gz files per Unaligned Project. Outputs a new, cleaned out_FQ.GZ file per .
+    With jobs > 1, lanes and Undetermined files are processed by a pool of jobs worker processes.
+    With max_memory (bytes per process), lane indexes are built by external sorting and Undetermined fastqs are cleaned by merge-join
+    against the index file (see makeSet2EliminateExternal and cleanUndeterminedMergeJoin), for lanes that do not fit in memory.
+    With lockstep=True, the read files of each Undetermined read set are cleaned together (see make_clean_undetermined_lockstep).
+    Finished outputs are recorded in the checkpoint manifest MANIFEST_NAME next to the config_file; with resume=True, outputs whose
+    inputs and index are unchanged are not redone (their MD5 checksums are checked too if verify=True).
+    If metrics are configured (see demuxtools.metrics), the index build of every lane, the cleaning of every Undetermined fastq and the whole run are recorded.
+    With lanes (e.g. ['L001']), only these lanes are processed, so that lanes can be cleaned by separate jobs.
+    With resident_tiles (e.g. 4), lane indexes are sharded by tile (see makeSet2EliminateSharded) and every read is tested against the index
+    of its tile, keeping at most resident_tiles tile indexes memory-mapped per process (see ShardedCoordIndex), so that memory follows
+    the size of a tile instead of a lane; max_memory then only bounds the buffers of the index build.
+    Usage example: clean_fastq( config_file = master_demux.conf, jobs = 8 )
+    """
+    st=time.time()
+    layout=loadRunLayout(config_file)
+    manifest=Manifest(layout.runFile(MANIFEST_NAME), verify=verify, resume=resume)
+    lane_tasks=collectLaneTasks(layout, lanes, resident_tiles)
+
+    with phase('run', config_file=config_file, jobs=jobs, max_memory=max_memory, lockstep=lockstep, resident_tiles=resident_tiles) as counters:
+        if jobs > 1:
+            clean_fastq_parallel(lane_tasks, jobs, max_memory, lockstep, manifest, resident_tiles)
+        else:
+            for (L, L_read1_file_list, headers_file, fq_list) in lane_tasks:
+                if resident_tiles:
+                    headers2remove = ShardedCoordIndex(makeSet2EliminateSharded(folder_path_list = L_read1_file_list, lane_pattern=L, output_dir = headers_file, max_memory = max_memory), resident_tiles)
+                elif max_memory:
+                    headers2remove = makeSet2EliminateExternal(folder_path_list = L_read1_file_list, lane_pattern=L, output_file = headers_file, max_memory = max_memory)
+                else:
+                    headers2remove = makeSet2Eliminate(folder_path_list = L_read1_file_list, lane_pattern=L, output_file = headers_file)
+                if lockstep:
+                    make_clean_undetermined_lockstep(headers2remove, fq_list, None if resident_tiles else max_memory, manifest, headers_file)
+                else:
+                    make_clean_undetermined(headers2remove, fq_list, None if resident_tiles else max_memory, manifest, headers_file)
+        counters.update(lanes=len(lane_tasks), undetermined_files=sum(len(i[3]) for i in lane_tasks))
+   
+#    with open("headers_set.txt", "w") as of:
+ #       of.write("\n".join(headers2remove))
+    et = time.time()
+    # get the execution time
+    elapsed_time = et - st
+    return(print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Cleaning Undetermined completed. Execution time: ", round(elapsed_time/60,1), ' minutes.',"\n", sep=""))
+
+def collectLaneTasks( layout, lanes=None, resident_tiles=None ):
+    """
+    Collects the lanes of a run to clean (all of LANES, or lanes only): returns a list of tuples (lane, unaligned R1 fastqs, headers file,
+    undetermined fastqs), the headers file being the tile index folder of the lane if resident_tiles is set (see makeSet2EliminateSharded).
+    Usage example: collectLaneTasks( layout = loadRunLayout('/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf'), lanes = ['L001'] )
+    """
+    lane_tasks=[]
+    for L in lanes or LANES:
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] .............. Processing lane ",L," ..............\n", sep="")
+        L_read1_file_list=layout.read1Files(READ1_PATTERN, L)
+
+        if L_read1_file_list:
+            headers_file=layout.runFile(L+'read_coordinates_to_eliminate'+('.tiles' if resident_tiles else '.idx'))
+            fq_list=layout.undeterminedFastqs(L)
+            print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Undetermined fastqs :\n\n", '\n'.join(fq_list), '\n',sep="")     
+            lane_tasks.append((L, L_read1_file_list, headers_file, fq_list))
+        else:
+            print("\n[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Lane ", L, " not present.", "\n", sep="")
+            pass
+    return(lane_tasks)
+
+def clean_fastq_parallel( lane_tasks, jobs, max_memory=None, lockstep=False, manifest=None, resident_tiles=None ):
+    """
+    Processes the lanes listed in lane_tasks with a pool of jobs worker processes. The coordinate index of every lane is built by one worker
+    and saved as a binary index file; as soon as it is ready, the Undetermined fastqs of the lane are cleaned by the workers, which memory-map the index
+    read-only instead of receiving a pickled copy. max_memory and the checkpoint manifest are passed on to every worker (see clean_fastq);
+    with lockstep=True, each worker cleans the read files of one Undetermined read set together; with resident_tiles, lane indexes are
+    sharded by tile and every worker maps at most resident_tiles tile indexes at once. Raises ChildProcessError if a worker process dies (see waitResult).
+    Usage example: clean_fastq_parallel( lane_tasks = [('L001', ['/home/Proj_1/S1_L001_R1_001.fastq.gz'], 'L001read_coordinates_to_eliminate.idx', {'/home/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz'})], jobs = 8 )
+    """
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Processing ", len(lane_tasks), " lanes with ", jobs, " worker processes.\n", sep="")
+    with multiprocessing.Pool(processes=jobs, initializer=initWorker, initargs=(dict(compression), dict(metrics), dict(prefilter), dict(pipeline))) as pool:
+        workers=multiprocessing.active_children()
+        index_results=[pool.apply_async(buildLaneIndex, (L, L_read1_file_list, headers_file, max_memory, resident_tiles)) for (L, L_read1_file_list, headers_file, fq_list) in lane_tasks]
+        clean_results=[]
+        for (L, L_read1_file_list, headers_file, fq_list), index_result in zip(lane_tasks, index_results):
+            index_file=waitResult(index_result, workers)
+            if lockstep:
+                for read_set in groupUndeterminedReads(fq_list).values():
+                    clean_results.append(pool.apply_async(cleanUndeterminedWorker, (index_file, sorted(read_set.values()), max_memory, True, manifest, resident_tiles)))
+            else:
+                for undet_FQ in sorted(fq_list):
+                    clean_results.append(pool.apply_async(cleanUndeterminedWorker, (index_file, undet_FQ, max_memory, False, manifest, resident_tiles)))
+        for n, clean_result in enumerate(clean_results, start=1):
+            waitResult(clean_result, workers)
+            print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] ", n, "/", len(clean_results), " Undetermined fastqs done.\n", sep="", flush=True)
+
+def checkWorkers( workers ):
+    """
+    Raises ChildProcessError if a process of workers, the worker processes of a pool (see multiprocessing.active_children), has exited,
+    e.g. killed by the out-of-memory killer: the pool replaces it, but the result of its task would never be ready.
+    Usage example: checkWorkers( workers = multiprocessing.active_children() )
+    """
+    for worker in workers:
+        if worker.exitcode is not None:
+            raise ChildProcessError("Worker process "+worker.name+" (pid "+str(worker.pid)+") exited with code "+str(worker.exitcode)+".")
+
+def waitResult( result, workers ):
+    """
+    Waits for the result of a pool task, checking every WORKER_POLL_INTERVAL seconds that no worker process has died (see checkWorkers).
+    Returns the result; an exception of the task is raised.
+    Usage example: waitResult( result = pool.apply_async(buildLaneIndex, (...)), workers = multiprocessing.active_children() )
+    """
+    while not result.ready():
+        checkWorkers(workers)
+        result.wait(WORKER_POLL_INTERVAL)
+    return(result.get())
+
+def initWorker( compression_settings, metrics_settings, prefilter_settings, pipeline_settings ):
+    """
+    Worker initializer: applies the compression, metrics, prefilter and pipeline settings of the main process (see configureCompression,
+    configureMetrics, configurePrefilter and configurePipeline).
+    Usage example: multiprocessing.Pool( processes = 8, initializer = initWorker, initargs = (dict(compression), dict(metrics), dict(prefilter), dict(pipeline)) )
+    """
+    configureCompression(**compression_settings)
+    configureMetrics(**metrics_settings)
+    configurePrefilter(**prefilter_settings)
+    configurePipeline(**pipeline_settings)
+
+def buildLaneIndex( lane_pattern, L_read1_file_list, headers_file, max_memory=None, resident_tiles=None ):
+    """
+    Worker: makes the coordinate index of a lane and saves it to the binary index file headers_file (see makeSet2Eliminate,
+    or makeSet2EliminateExternal if max_memory is set), or to the tile index folder headers_file if resident_tiles is set (see makeSet2EliminateSharded).
+    Returns the path of the index file.
+    Usage example: buildLaneIndex( lane_pattern = 'L001', L_read1_file_list = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'], headers_file = 'L001read_coordinates_to_eliminate.idx' )
+    """
+    worker=multiprocessing.current_process().name
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] [", worker, "] Building coordinate index for lane ", lane_pattern, ".\n", sep="", flush=True)
+    if resident_tiles:
+        makeSet2EliminateSharded(folder_path_list = L_read1_file_list, lane_pattern=lane_pattern, output_dir = headers_file, max_memory = max_memory)
+    elif max_memory:
+        makeSet2EliminateExternal(folder_path_list = L_read1_file_list, lane_pattern=lane_pattern, output_file = headers_file, max_memory = max_memory)
+    else:
+        makeSet2Eliminate(folder_path_list = L_read1_file_list, lane_pattern=lane_pattern, output_file = headers_file)
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] [", worker, "] Coordinate index for lane ", lane_pattern, " saved to ", headers_file, ".\n", sep="", flush=True)
+    return(headers_file)
+
+def cleanUndeterminedWorker( index_file, undet_FQ, max_memory=None, lockstep=False, manifest=None, resident_tiles=None ):
+    """
+    Worker: cleans one Undetermined fastq with the lane coordinate index memory-mapped read-only from index_file
+    (or merge-joined with it if max_memory is set, or tile by tile from the tile index folder index_file if resident_tiles is set, see ShardedCoordIndex).
+    With lockstep=True, undet_FQ is the list of read files of one read set.
+    Finished outputs are recorded in manifest if given (see make_clean_undetermined). Returns the totals of the cleaned files (see make_clean_undetermined).
+    Usage example: cleanUndeterminedWorker( index_file = 'L001read_coordinates_to_eliminate.idx', undet_FQ = '/home/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz' )
+    """
+    worker=multiprocessing.current_process().name
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] [", worker, "] Cleaning ", undet_FQ, ".\n", sep="", flush=True)
+    if resident_tiles:
+        (headers2remove, max_memory)=(ShardedCoordIndex(index_file, resident_tiles), None)
+    else:
+        headers2remove=index_file if max_memory else loadCoordIndex(index_file)
+    if lockstep:
+        totals=make_clean_undetermined_lockstep(headers2remove, undet_FQ, max_memory, manifest, index_file)
+    else:
+        totals=make_clean_undetermined(headers2remove, [undet_FQ], max_memory, manifest, index_file)
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] [", worker, "] Done cleaning ", undet_FQ, ".\n", sep="", flush=True)
+    return(totals)
+
+def make_clean_undetermined(headers2remove, fq_list, max_memory=None, manifest=None, index_file=None):
+    """
+    Cleans every Undetermined fastq of fq_list into the Undetermined_clean folder next to it. Outputs are written to a temporary
+    file and renamed when complete (see atomicPath), so an output that is present is always complete.
+    headers2remove is the lane coordinate index (see cleanUndetermined), or the path of the index file if max_memory is set (see cleanUndeterminedMergeJoin).
+    With a checkpoint manifest (see demuxtools.manifest), each output is recorded with its Undetermined fastq and index_file, and
+    skipped if recorded with the same, unchanged inputs; without one, outputs already present are skipped.
+    The reads kept and dropped, time and throughput of every cleaned file are recorded as 'clean' phase metrics (see demuxtools.metrics).
+    Returns the totals of the files cleaned: a dict {'files', 'skipped', 'reads', 'kept', 'in_bytes'}.
+    Usage example: make_clean_undetermined( headers2remove = makeSet2Eliminate(...), fq_list = ['/home/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz'] )
+    """
+    totals=dict.fromkeys(('files', 'skipped', 'reads', 'kept', 'in_bytes'), 0)
+    for undet_FQ in fq_list: 
+        if os.path.isfile(undet_FQ):
+            print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip(),"] Starting fastq cleaning module for \n\n", undet_FQ,"\n", sep="")
+            out_file_FQ=makeCleanOutputPath(undet_FQ)
+            inputs=[undet_FQ]+([index_file] if index_file else [])
+            # clean the Undetermined fastq
+            if isCleanOutputDone(manifest, inputs, [out_file_FQ]):
+                print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Output file ",out_file_FQ," already present.\n", sep="")      
+                totals['skipped']+=1
+            else:
+                with phase('clean', profile=True, input=undet_FQ, output=out_file_FQ, merge_join=bool(max_memory)) as counters:
+                    before=dict(prefilter_stats)
+                    with atomicPath(out_file_FQ) as tmp_FQ:
+                        if max_memory:
+                            (n_reads, n_kept)=cleanUndeterminedMergeJoin(headers2remove,undet_FQ,tmp_FQ,max_memory)
+                        else:
+                            (n_reads, n_kept)=cleanUndetermined(headers2remove,undet_FQ,tmp_FQ)
+                    counters.update(reads=n_reads, kept=n_kept, dropped=n_reads-n_kept, in_bytes=os.path.getsize(undet_FQ), out_bytes=os.path.getsize(out_file_FQ))
+                    counters.update(prefilterCounters(before, undet_FQ))
+                addTotals(totals, counters)
+                if manifest is not None:
+                    manifest.record(os.path.abspath(out_file_FQ), inputs, [out_file_FQ])
+                print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Output file created: ",out_file_FQ,"\n", sep="")
+            print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Fastq cleaning module for ", undet_FQ," completed.","\n", sep="")
+        else:
+            print('File does not exist; skipping ',undet_FQ)
+            pass
+    return(totals)
+
+def addTotals( totals, counters, files=1 ):
+    """
+    Adds the reads, kept reads and input bytes of the counters of a 'clean' phase to totals, as files more files cleaned.
+    Usage example: addTotals( totals = {'files': 0, 'skipped': 0, 'reads': 0, 'kept': 0, 'in_bytes': 0}, counters = {'reads': 1000, 'kept': 400, 'in_bytes': 65536} )
+    """
+    totals['files']+=files
+    for i in ('reads', 'kept', 'in_bytes'):
+        totals[i]+=counters[i]
+
+def reportPrefilter( index_files ):
+    """
+    Reports the prefilter of the index files of a lane (the mean estimated false-positive rate if several), if a prefilter is configured (see configurePrefilter).
+    Usage example: reportPrefilter( index_files = ['L001read_coordinates_to_eliminate.idx'] )
+    """
+    if not prefilter['bits_per_key']:
+        return
+    blooms=[readCoordIndexHeader(i)[0]['bloom'] for i in index_files]
+    if blooms:
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Prefilter of ", blooms[0]['bits_per_key'], " bits per read coordinate and ", blooms[0]['hashes'],
+              " hashes, ", sum(8*i['words'] for i in blooms), " bytes, estimated false-positive rate ", round(100*sum(i['fpr'] for i in blooms)/len(blooms), 3), "%.\n", sep="")
+
+def prefilterCounters( before, name ):
+    """
+    Returns the prefilter counters of the reads tested since before (a copy of prefilter_stats) for the metrics of a cleaned file name:
+    reads passed by the prefilter and observed false-positive rate (reads passed but absent from the index, over reads absent from the index),
+    and reports them. Returns an empty dict if no read was tested against a prefilter.
+    Usage example: prefilterCounters( before = dict(prefilter_stats), name = 'Undetermined_S0_L001_R1_001.fastq.gz' )
+    """
+    (tested, passed, present)=(prefilter_stats[i]-before[i] for i in ('tested', 'passed', 'present'))
+    if not tested:
+        return({})
+    fpr=(passed-present)/max(tested-present, 1)
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Prefilter passed ", passed, " of ", tested, " reads of ", name, " (", present,
+          " in the index): observed false-positive rate ", round(100*fpr, 3), "%.\n", sep="")
+    return({'prefilter_passed': passed, 'prefilter_fpr': round(fpr, 6)})
+
+def isCleanOutputDone( manifest, inputs, out_files ):
+    """
+    Tests if the cleaned files out_files are done: recorded in the checkpoint manifest with the same, unchanged inputs if a manifest
+    is given (see Manifest.isDone), present otherwise.
+    Usage example: isCleanOutputDone( manifest = Manifest('cleanUndetermined.manifest.json'), inputs = ['Undetermined_S0_L001_R1_001.fastq.gz', 'L001read_coordinates_to_eliminate.idx'], out_files = ['Undetermined_clean_S0_L001_R1_001.fastq.gz'] )
+    """
+    if manifest is not None:
+        return(manifest.isDone(os.path.abspath(out_files[0]), inputs, out_files))
+    return(all(os.path.isfile(i) for i in out_files))
+
+def makeCleanOutputPath( undet_FQ ):
+    """
+    Returns the path of the cleaned file of an Undetermined fastq (Undetermined_clean_* in the Undetermined_clean folder next to
+    the Undetermined folder), creating the folder if needed.
+    Usage example: makeCleanOutputPath( undet_FQ = '/home/UnalignedBCL1/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz' )
+    """
+    new_Undet_path='/'.join(undet_FQ.split("/")[:-1])+'_clean' #os.path.join(undet_FQ_path,'Undetermined')
+    try:
+        os.mkdir(new_Undet_path,mode=0o777)
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Directory ", new_Undet_path, " created.","\n", sep="")
+    except FileExistsError:
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Directory ", new_Undet_path, " already exists.","\n", sep="")
+
+    file_name=undet_FQ.split(sep="/")[-1].replace('Undetermined_', 'Undetermined_clean_')
+    return(os.path.join(new_Undet_path, file_name))
+
+def groupUndeterminedReads( fq_list ):
+    """
+    Groups Undetermined fastqs into read sets: files of the same folder whose names differ only by the read tag (R1, R2, R3, I1, I2).
+    Returns a dict {read set name: {read tag: path}}; files without a read tag form a read set of their own.
+    Usage example: groupUndeterminedReads( fq_list = ['/home/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz', '/home/Undetermined/Undetermined_S0_L001_R2_001.fastq.gz'] )
+    """
+    read_sets={}
+    for undet_FQ in sorted(fq_list):
+        match=READ_TAG.search(undet_FQ)
+        if match:
+            read_sets.setdefault(READ_TAG.sub(r'_*_\2', undet_FQ), {})[match.group(1)]=undet_FQ
+        else:
+            read_sets[undet_FQ]={'R1': undet_FQ}
+    return(read_sets)
+
+def make_clean_undetermined_lockstep(headers2remove, fq_list, max_memory=None, manifest=None, index_file=None):
+    """
+    Cleans the Undetermined fastqs of fq_list read set by read set (see groupUndeterminedReads and cleanUndeterminedLockstep).
+    A read set is skipped if all its cleaned files are done; headers2remove, manifest and index_file are as for make_clean_undetermined,
+    a read set is recorded in the manifest under the first of its sorted outputs. Returns the totals of the files cleaned (see make_clean_undetermined).
+    Usage example: make_clean_undetermined_lockstep( headers2remove = makeSet2Eliminate(...), fq_list = ['/home/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz', '/home/Undetermined/Undetermined_S0_L001_R2_001.fastq.gz'] )
+    """
+    totals=dict.fromkeys(('files', 'skipped', 'reads', 'kept', 'in_bytes'), 0)
+    for (read_set, read_files) in groupUndeterminedReads([i for i in fq_list if os.path.isfile(i)]).items():
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip(),"] Starting lockstep fastq cleaning module for \n\n", '\n'.join(sorted(read_files.values())),"\n", sep="")
+        out_files={read: makeCleanOutputPath(undet_FQ) for (read, undet_FQ) in read_files.items()}
+        inputs=sorted(read_files.values())+([index_file] if index_file else [])
+        if isCleanOutputDone(manifest, inputs, sorted(out_files.values())):
+            print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Output files of ",read_set," already present.\n", sep="")
+            totals['skipped']+=len(read_files)
+        else:
+            with phase('clean', profile=True, input=sorted(read_files.values()), output=sorted(out_files.values()), merge_join=bool(max_memory), lockstep=True) as counters:
+                before=dict(prefilter_stats)
+                with ExitStack() as stack:
+                    tmp_files={read: stack.enter_context(atomicPath(out_file)) for (read, out_file) in out_files.items()}
+                    if max_memory:
+                        (n_reads, n_kept)=cleanUndeterminedLockstep(loadCoordIndex(headers2remove), read_files, tmp_files, window=max(max_memory//4//8, 4096))
+                    else:
+                        (n_reads, n_kept)=cleanUndeterminedLockstep(headers2remove, read_files, tmp_files)
+                counters.update(reads=n_reads, kept=n_kept, dropped=n_reads-n_kept, in_bytes=sum(os.path.getsize(i) for i in read_files.values()),
+                                out_bytes=sum(os.path.getsize(i) for i in out_files.values()))
+                counters.update(prefilterCounters(before, read_set))
+            addTotals(totals, counters, len(read_files))
+            if manifest is not None:
+                manifest.record(os.path.abspath(sorted(out_files.values())[0]), inputs, sorted(out_files.values()))
+            print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Output files created: \n\n",'\n'.join(sorted(out_files.values())),"\n", sep="")
+        print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] Lockstep fastq cleaning module for ", read_set," completed.","\n", sep="")
+    return(totals)
+
+def cleanUndeterminedLockstep( headers_set, read_files, out_files, batch_size=None, window=None ):
+    """
+    Cleans the record-aligned read files of one read set ({read tag: path}) in one pass: batches of records are read from all files
+    together, keep or drop is decided once per read from the coordinates of R1 (or of the first read tag if there is no R1), and
+    kept reads are written to the out_files ({read tag: path}) of every read. batch_size defaults to the configured batch size (see configurePipeline). Raises ValueError at the first record whose read
+    name differs between the files, or if they do not have the same number of records. With window, the index is merge-joined (see mergeJoinCoordIndex) instead of searched in memory.
+    Returns a tuple with the number of reads (records per file) read and kept.
+    Usage example: cleanUndeterminedLockstep( headers_set = makeSet2Eliminate(...), read_files = {'R1': 'Undetermined_S0_L001_R1_001.fastq.gz', 'R2': 'Undetermined_S0_L001_R2_001.fastq.gz'},
+    out_files = {'R1': 'Undetermined_clean_S0_L001_R1_001.fastq.gz', 'R2': 'Undetermined_clean_S0_L001_R2_001.fastq.gz'} )
+    """
+    batch_size=batch_size or pipeline['batch_size']
+    reads=sorted(read_files)
+    lead='R1' if 'R1' in read_files else reads[0]
+    in_handles={read: openFastq(read_files[read], "rt") for read in reads}
+    out_handles={}
+    try:
+        for read in reads:
+            out_handles[read]=openFastq(out_files[read], "wt")
+        iterators={read: fastqRecords(in_handles[read]) for read in reads}
+        n_done=0
+        n_kept=0
+        while True:
+            batches={read: list(islice(iterators[read], batch_size)) for read in reads}
+            names=[j[0].split(None, 1)[0] for j in batches[lead]]
+            for read in reads:
+                if read == lead:
+                    continue
+                other=[j[0].split(None, 1)[0] for j in batches[read]]
+                bad=next((i for (i, (name, other_name)) in enumerate(zip(names, other)) if name != other_name), None)
+                if bad is not None:
+                    raise ValueError("Record "+str(n_done+bad+1)+" is "+names[bad]+" in "+read_files[lead]+" but "+other[bad]+" in "+read_files[read]+": files are not synchronized.")
+                if len(other) != len(names):
+                    raise ValueError("Files "+read_files[lead]+" and "+read_files[read]+" do not have the same number of records.")
+            if not names:
+                break
+            packed=packCoordinateArrays(*parseTitleCoordinates([j[0] for j in batches[lead]]))
+            present=inCoordIndex(headers_set, packed) if window is None else mergeJoinCoordIndex(headers_set, window, packed)
+            for read in reads:
+                out_handles[read].write(''.join("@%s\n%s\n+\n%s\n" % j for j, p in zip(batches[read], present) if not p))
+            n_done+=len(names)
+            n_kept+=len(names)-int(np.count_nonzero(present))
+    finally:
+        for handle in list(in_handles.values())+list(out_handles.values()):
+            handle.close()
+    return(n_done, n_kept)
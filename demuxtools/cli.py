@@ -0,0 +1,324 @@
+#############################################################################
+### Command line of the DEMUX tools: python -m demuxtools <command> ...
+###
+###   clean  : clean the Undetermined fastqs of a run (sortUndetermined_bcl2fastq.12.py)
+###   tiles  : write the read coordinates per tile (sortReadsPerTIle.py)
+###   layout : print the run layout (projects, lanes, fastqs) as JSON
+###   batch  : clean the Undetermined fastqs of many runs on one worker pool
+###
+### Only the argument parsing is done here; the module of a command (and
+### with it NumPy and Biopython) is imported when the command runs, so
+### that small commands such as layout start quickly.
+#############################################################################
+
+import argparse
+import json
+import os
+import sys
+from argparse import RawTextHelpFormatter
+from contextlib import contextmanager
+
+from demuxtools.fastqio import READ_BACKENDS, WRITE_BACKENDS
+from demuxtools.log import printMsg
+
+#############################################################################
+# Variables
+#############################################################################
+CONFIG_HELP='''Config file master_demux.conf that must be present in the DEMUX_RUN directory.
+It defines all demultiplexings done for the Sequencing Run. Example master_demux.conf :
+
+[DEMUX]
+unaligned_suffix=BCL1
+OverrideCycles=Y151;I10N6;I10;Y151
+BarcodeMismatchesIndex1=1
+sample_project=SpiderConeSnail_MR,CoPo_JM,PhixSeqC_LG
+
+[DEMUX]
+unaligned_suffix=BCL2
+OverrideCycles=Y151;I8Y8;I8N2;Y151
+BarcodeMismatchesIndex1=1
+sample_project=TimemaChip_TS
+'''
+CONDA_HELP='''*** Before using on DCSR, activate the appropriate conda environment:
+    module load gcc miniconda3
+    conda activate demux_dev'''
+CLEAN_DESCRIPTION='''*********************************************************************
+*** This script sorts undetermined for bcl2fastq pipeline output. ***
+*********************************************************************
+
+*** Removes all sample-attributed reads from Undetermined.fastq.gz reads per DEMUX declared in the config_file.
+*** Processes R1, R2, I1, I2 and R3 separately.
+*** Outputs a new Undetermined_clean.fastq.gz file per DEMUX contaning only non-attributed reads (real Undetermined).
+*** Usage example: python -m demuxtools clean /work/../DEMUX/221107_JABBA_0000_AHABABA/master_demux.conf
+
+'''+CONDA_HELP
+TILES_DESCRIPTION='''*********************************************************************
+*** This script extracts read coordinates and writes to file per tile for all fastq files from Unaligned projects. ***
+*********************************************************************
+
+*** Outputs a folder with a file per tile with read coordiantes associated to Unaligned projects.
+*** Usage example: python -m demuxtools tiles /work/../DEMUX/221107_JABBA_0000_AHABABA/master_demux.conf
+
+'''+CONDA_HELP
+LAYOUT_DESCRIPTION='''*** Prints the layout of a run as JSON: demultiplexings, project folders and, per lane, the project R1 fastqs
+*** and the Undetermined fastqs. Does not import NumPy or Biopython, e.g. to plan per-lane jobs:
+*** python -m demuxtools layout /work/../DEMUX/221107_JABBA_0000_AHABABA/master_demux.conf'''
+BATCH_DESCRIPTION='''*** Cleans the Undetermined fastqs of many runs, given as config files or as folders (e.g. a DEMUX root) searched for
+*** master_demux.conf files, with one pool of worker processes. The lanes of all runs are scheduled onto the pool, the largest
+*** first, as long as their estimated index memory fits in what the workers leave of --memory-budget. Prints a throughput summary per run.
+*** With --metrics, metrics go to cleanUndetermined.metrics.jsonl in the DEMUX_RUN directory of the first run by default.
+*** Usage example: python -m demuxtools batch /work/../DEMUX -j 16 --memory-budget 65536
+
+'''+CONDA_HELP
+EPILOG="""*** All is well that ends well."""
+
+#############################################################################
+# Functions
+#############################################################################
+def addCleanArguments( parser ):
+    """
+    Adds the arguments of the clean command to parser.
+    Usage example: addCleanArguments( parser = argparse.ArgumentParser() )
+    """
+    parser.add_argument('config_file', help=CONFIG_HELP)
+    addCleanOptions(parser)
+
+def addCleanOptions( parser ):
+    """
+    Adds the options of the clean command, shared with the batch command, to parser.
+    Usage example: addCleanOptions( parser = argparse.ArgumentParser() )
+    """
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+    help='''Number of worker processes (default: 1). With N > 1, lanes are indexed and Undetermined files are
+cleaned in parallel; each lane index is shared read-only with the workers by memory-mapping its index file.
+Note that up to N lane indexes may be built at once.''')
+    parser.add_argument('--lanes', nargs='+', choices=('L001', 'L002', 'L003', 'L004'), default=None,
+    help='''Only clean these lanes (default: all lanes present), e.g. to clean the lanes of a run in separate jobs.''')
+    parser.add_argument('--read-backend', choices=READ_BACKENDS, default='auto',
+    help='''Decompression backend for all fastq.gz input (default: auto, the fastest available of isal, zlib-ng,
+an igzip/pigz/gzip helper process, and python gzip).''')
+    parser.add_argument('--write-backend', choices=WRITE_BACKENDS, default='gzip',
+    help='''Compression backend for the Undetermined_clean fastq.gz files (default: gzip). bgzf writes BGZF blocks
+compressed by --compress-threads threads; isal and zlib-ng are used if installed.''')
+    parser.add_argument('--compress-level', type=int, default=9,
+    help='''Compression level of the Undetermined_clean fastq.gz files (default: 9).''')
+    parser.add_argument('--compress-threads', type=int, default=1,
+    help='''Compression threads per output file for the bgzf, isal and zlib-ng backends (default: 1).''')
+    parser.add_argument('--max-memory', type=int, default=None, metavar='MB',
+    help='''Bound the memory used for read coordinates to about MB megabytes per process: lane indexes are built by
+external sorting in spilled runs and Undetermined fastqs are cleaned by merge-join against the index file.
+For lanes whose coordinates do not fit in memory. The output is the same as without this option.''')
+    parser.add_argument('--lockstep', action='store_true',
+    help='''Clean the R1, R2, R3, I1 and I2 Undetermined fastqs of a lane together, in one pass over the
+record-aligned files: keep or drop is decided once per read from R1 and applied to all outputs.
+Stops with an error if the read names of the files are not synchronized.''')
+    parser.add_argument('--tile-shards', action='store_true',
+    help='''Shard the lane indexes by tile: one index per tile in the folder L00Xread_coordinates_to_eliminate.tiles, built one tile
+at a time, and every Undetermined read tested against the index of its tile. Memory then follows the size of a tile
+instead of a lane, e.g. for NovaSeq X 25B flowcells. The output is the same as without this option.''')
+    parser.add_argument('--resident-tiles', type=int, default=4, metavar='N',
+    help='''With --tile-shards, number of tile indexes kept memory-mapped at once per process (default: 4).''')
+    parser.add_argument('--prefilter', type=int, nargs='?', const=12, default=0, metavar='BITS',
+    help='''Save a Bloom filter of BITS bits per read coordinate (default: 12, about 1%% false positives) with every lane
+index and test Undetermined reads against it first: only the reads it passes are searched in the index. The output
+is the same as without this option. Indexes built without the filter are rebuilt.''')
+    parser.add_argument('--pipeline', action='store_true',
+    help='''Clean every Undetermined fastq with a threaded pipeline: decompression and parsing, filtering, and compression and
+writing run at the same time in their own threads, connected by queues of at most --queue-depth batches. The time every
+stage spent working and waiting is logged and recorded in the metrics, the busiest stage being the bottleneck.''')
+    parser.add_argument('--batch-size', type=int, default=100000, metavar='READS',
+    help='''Reads per batch tested against the index and passed between pipeline stages (default: 100000).''')
+    parser.add_argument('--queue-depth', type=int, default=4, metavar='BATCHES',
+    help='''With --pipeline, maximum number of batches waiting between two stages (default: 4).''')
+    parser.add_argument('--no-resume', action='store_true',
+    help='''Reprocess all Undetermined fastqs. By default, a rerun skips the files recorded as done in
+cleanUndetermined.manifest.json (in the DEMUX_RUN directory) whose inputs and outputs are unchanged.''')
+    addCommonArguments(parser, 'cleanUndetermined', '''and reads kept and
+dropped per Undetermined fastq''', 'the cleaning of the Undetermined fastqs')
+
+def addBatchArguments( parser ):
+    """
+    Adds the arguments of the batch command to parser.
+    Usage example: addBatchArguments( parser = argparse.ArgumentParser() )
+    """
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+    help='''Config files master_demux.conf of the runs to clean, or folders (e.g. a DEMUX root) in which master_demux.conf
+files are searched up to two folders down.''')
+    parser.add_argument('--memory-budget', type=int, default=None, metavar='MB',
+    help='''Memory available to all workers together, in megabytes (default: no budget). Every worker takes --worker-memory
+plus its record batches (--batch-size reads, times --queue-depth+2 with --pipeline or 5 with --lockstep); there are fewer
+workers than --jobs if they do not fit. A lane is started only when the estimated memory of its index fits in what the
+workers and the running lanes left; a lane that cannot fit at all is cleaned with external sorting and merge-join within
+the budget. The output is the same as without this option.''')
+    parser.add_argument('--worker-memory', type=int, default=64, metavar='MB',
+    help='''Resident memory of a worker process without its record batches, in megabytes, counted against --memory-budget
+(default: 64, about 45 measured).''')
+    addCleanOptions(parser)
+
+def addTilesArguments( parser ):
+    """
+    Adds the arguments of the tiles command to parser.
+    Usage example: addTilesArguments( parser = argparse.ArgumentParser() )
+    """
+    parser.add_argument('config_file', help=CONFIG_HELP)
+    parser.add_argument('--read-backend', choices=READ_BACKENDS, default='auto',
+    help='''Decompression backend for all fastq.gz input (default: auto, the fastest available of isal, zlib-ng,
+an igzip/pigz/gzip helper process, and python gzip).''')
+    parser.add_argument('--max-open-files', type=int, default=256,
+    help='''Maximum number of per-tile files kept open at once; the least recently used are closed first (default: 256).
+Keep it well under the open files limit (ulimit -n).''')
+    parser.add_argument('--tile-buffer-size', type=int, default=1<<20,
+    help='''Bytes of read coordinates buffered per tile before they are written to the tile file (default: 1048576).''')
+    parser.add_argument('--stream', action='store_true',
+    help='''Stream the read coordinates extracted from the *_R1_001.* files straight into the tile files, without
+writing and re-reading the combined readsCoordiates.txt file.''')
+    parser.add_argument('--keep-combined', action='store_true',
+    help='''With --stream, also write the combined readsCoordiates.txt file.''')
+    parser.add_argument('--sort-tiles', action='store_true',
+    help='''Sort the read coordinates of every tile file by x, then y.''')
+    parser.add_argument('--tile-format', choices=('text', 'store', 'both'), default='text',
+    help='''Output of the read coordinates per tile: one text file per tile (text, default), one memory-mapped
+tile store perTileReadsTMP/readCoordinates.tilestore, with a tile offset table, instead of the tile files
+(store), or both. The store is built straight from the read coordinates by external sorting, without any
+per-tile file, and holds the reads of a tile sorted by x, then y. Read it with demuxtools.tilestore.TileStore.''')
+    parser.add_argument('--no-resume', action='store_true',
+    help='''Redo all steps. By default, a rerun skips the steps recorded as done in sortReadsPerTile.manifest.json
+(in the DEMUX_RUN directory) whose input fastqs and outputs are unchanged.''')
+    addCommonArguments(parser, 'sortReadsPerTile', '', 'the extraction and splitting of the read coordinates')
+
+def addCommonArguments( parser, tool, metrics_help, profile_help ):
+    """
+    Adds the --verify-outputs, --metrics, --profile and --listing-cache arguments of tool to parser.
+    """
+    parser.add_argument('--verify-outputs', action='store_true',
+    help='''On resume, also check the MD5 checksums of finished outputs against the manifest (default: sizes only).''')
+    parser.add_argument('--metrics', metavar='FILE', nargs='?', const='', default=None,
+    help='''Append metrics to the JSON lines file FILE: time, reads/s, bytes/s and peak memory per phase'''+(', '+metrics_help if metrics_help else '')+'''
+(FILE defaults to '''+tool+'''.metrics.jsonl in the DEMUX_RUN directory). No metrics are written without this option.''')
+    parser.add_argument('--profile', action='store_true',
+    help='''Profile '''+profile_help+''' with cProfile: statistics are dumped per process to
+'''+tool+'''.<pid>.prof next to the metrics file. Implies --metrics.''')
+    parser.add_argument('--listing-cache', action='store_true',
+    help='''Save the listings of the project and Undetermined folders to .demuxtools.listings.json in the DEMUX_RUN directory
+and reuse them, in later runs of any command, for the folders whose modification time is unchanged. Saves listing
+folders of thousands of files again on a network filesystem (GPFS, NFS).''')
+
+def configureRun( args, tool, metrics_dir=None ):
+    """
+    Applies the compression, metrics and listing cache arguments of a command (see configureCompression, configureMetrics and configureListingCache).
+    The default metrics file is written to metrics_dir, by default the folder of the config file.
+    """
+    from demuxtools.fastqio import configureCompression
+    from demuxtools.layout import configureListingCache
+    from demuxtools.metrics import configureMetrics
+    configureCompression(read_backend = args.read_backend, write_backend = getattr(args, 'write_backend', 'gzip'),
+                         level = getattr(args, 'compress_level', 9), threads = getattr(args, 'compress_threads', 1))
+    configureListingCache(enabled = args.listing_cache)
+    if args.metrics is not None or args.profile:
+        metrics_file=args.metrics or os.path.join(metrics_dir or os.path.dirname(os.path.abspath(args.config_file)), tool+'.metrics.jsonl')
+        configureMetrics(file = metrics_file, tool = tool, profile = os.path.join(os.path.dirname(metrics_file), tool) if args.profile else None)
+
+@contextmanager
+def fatalErrors():
+    """
+    Exits with a fatal error on a ValueError raised by a command, e.g. by a worker process and passed on by its pool, or on the
+    ChildProcessError of a dead worker process (see demuxtools.clean.checkWorkers): the library modules raise, only the command line exits.
+    Usage example: with fatalErrors(): clean_fastq(...)
+    """
+    try:
+        yield
+    except (ValueError, ChildProcessError) as e:
+        sys.exit("[FATAL] "+str(e))
+
+def runClean( args ):
+    """
+    Runs the clean command (see demuxtools.clean.clean_fastq).
+    """
+    from demuxtools.clean import clean_fastq
+    with fatalErrors():
+        configureClean(args)
+        clean_fastq(config_file = args.config_file, jobs = args.jobs, max_memory = args.max_memory*(1<<20) if args.max_memory else None,
+                    lockstep = args.lockstep, resume = not args.no_resume, verify = args.verify_outputs, lanes = args.lanes,
+                    resident_tiles = args.resident_tiles if args.tile_shards else None)
+
+def runBatch( args ):
+    """
+    Runs the batch command (see demuxtools.batch.cleanRuns). The default metrics file is written to the DEMUX_RUN directory of the first run.
+    """
+    from demuxtools.batch import cleanRuns, discoverConfigs
+    config_files=discoverConfigs(args.paths)
+    with fatalErrors():
+        configureClean(args, os.path.dirname(config_files[0]))
+        printMsg("Runs to clean :")
+        print('\n'.join(config_files), '\n')
+        cleanRuns(config_files = config_files, jobs = args.jobs, memory_budget = args.memory_budget*(1<<20) if args.memory_budget else None,
+                  max_memory = args.max_memory*(1<<20) if args.max_memory else None, lockstep = args.lockstep, resume = not args.no_resume,
+                  verify = args.verify_outputs, lanes = args.lanes, resident_tiles = args.resident_tiles if args.tile_shards else None,
+                  worker_memory = args.worker_memory*(1<<20))
+
+def configureClean( args, metrics_dir=None ):
+    """
+    Applies the compression, metrics, prefilter and pipeline arguments of the clean and batch commands (see configureRun).
+    """
+    from demuxtools.coordindex import configurePrefilter
+    from demuxtools.pipeline import configurePipeline
+    configureRun(args, 'cleanUndetermined', metrics_dir)
+    configurePrefilter(bits_per_key = args.prefilter)
+    configurePipeline(enabled = args.pipeline, batch_size = args.batch_size, depth = args.queue_depth)
+
+def runTiles( args ):
+    """
+    Runs the tiles command (see demuxtools.tiles.sortReadCoorsPerTile).
+    """
+    from demuxtools.tiles import sortReadCoorsPerTile
+    configureRun(args, 'sortReadsPerTile')
+    sortReadCoorsPerTile(conf_file = args.config_file, max_open_files = args.max_open_files, tile_buffer_size = args.tile_buffer_size,
+                         stream = args.stream, keep_combined = args.keep_combined, sort_tiles = args.sort_tiles,
+                         tile_format = args.tile_format, resume = not args.no_resume, verify = args.verify_outputs)
+
+def runLayout( args ):
+    """
+    Runs the layout command: prints the run layout as JSON.
+    """
+    from demuxtools.layout import loadRunLayout, READ1_PATTERN
+    layout=loadRunLayout(args.config_file, verbose=False)
+    lanes={lane: {'read1_files': layout.read1Files(READ1_PATTERN, lane), 'undetermined_fastqs': layout.undeterminedFastqs(lane)}
+           for lane in layout.lanes(READ1_PATTERN)}
+    json.dump({'config_file': layout.config_file, 'root': layout.root, 'demuxes': layout.demuxes,
+               'project_paths': layout.project_paths, 'lanes': lanes}, sys.stdout, indent=1)
+    print()
+
+def makeParser():
+    """
+    Makes the argument parser of python -m demuxtools, with one subcommand per command.
+    """
+    parser=argparse.ArgumentParser(prog='python -m demuxtools', description='DEMUX tools for bcl2fastq run folders.', epilog=EPILOG)
+    commands=parser.add_subparsers(dest='command', metavar='command', required=True)
+    addCleanArguments(commands.add_parser('clean', help='Clean the Undetermined fastqs of a run.', description=CLEAN_DESCRIPTION,
+                                          epilog=EPILOG, formatter_class=RawTextHelpFormatter))
+    addTilesArguments(commands.add_parser('tiles', help='Write the read coordinates of a run per tile.', description=TILES_DESCRIPTION,
+                                          epilog=EPILOG, formatter_class=RawTextHelpFormatter))
+    addBatchArguments(commands.add_parser('batch', help='Clean the Undetermined fastqs of many runs on one worker pool.', description=BATCH_DESCRIPTION,
+                                          epilog=EPILOG, formatter_class=RawTextHelpFormatter))
+    commands.add_parser('layout', help='Print the run layout as JSON.', description=LAYOUT_DESCRIPTION,
+                        formatter_class=RawTextHelpFormatter).add_argument('config_file', help=CONFIG_HELP)
+    return(parser)
+
+def main( argv=None ):
+    """
+    Entry point of python -m demuxtools. Returns the exit status.
+    Usage example: main( argv = ['clean', '/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf', '-j', '8'] )
+    """
+    args=makeParser().parse_args(argv)
+    if args.command == 'layout':
+        runLayout(args)
+        return(0)
+    printMsg("............................ Starting python module ............................")
+    if args.command == 'clean':
+        runClean(args)
+    elif args.command == 'batch':
+        runBatch(args)
+    else:
+        runTiles(args)
+    printMsg("............................ End of python module ............................")
+    return(0)
@@ -0,0 +1,517 @@
+#############################################################################
+### Packed read coordinates and the binary coordinate index file.
+###
+### A read coordinate lane:tile:x:y is packed into one 64-bit integer
+### (LANE_BITS | TILE_BITS | X_BITS | Y_BITS). The reads of a lane to remove
+### from the Undetermined fastqs are kept as a sorted, de-duplicated NumPy
+### uint64 index, saved to a binary index file that is memory-mapped by
+### the cleaning workers, and searched by binary search or merge-join.
+### A lane index can also be sharded by tile: one index file per tile in a
+### folder, of which only a few are memory-mapped at a time while cleaning
+### (see ShardedCoordIndex).
+### With a prefilter configured (see configurePrefilter), a blocked Bloom
+### filter of the coordinates is saved after them in the index file and
+### tested first, so that most reads absent from the index (the real
+### Undetermined reads) never reach the binary search of the index.
+#############################################################################
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+#############################################################################
+# Variables
+#############################################################################
+# bit layout of a read coordinate packed into a 64-bit integer: lane | tile | x | y
+LANE_BITS=4
+TILE_BITS=18
+X_BITS=21
+Y_BITS=21
+# binary coordinate index file: magic, header length, JSON header, packed little-endian uint64 coordinates
+INDEX_MAGIC=b'KBCIDX01'
+INDEX_VERSION=1
+# suffix of the tile index files of a sharded index folder, named <lane>_<tile>.idx
+SHARD_SUFFIX='.idx'
+# current prefilter settings, see configurePrefilter
+prefilter={'bits_per_key': 0}
+# reads tested against prefiltered indexes by this process, passed by the prefilter and present in the index
+prefilter_stats={'tested': 0, 'passed': 0, 'present': 0}
+
+#############################################################################
+# Functions
+#############################################################################
+def configurePrefilter( bits_per_key=0 ):
+    """
+    Sets the size of the Bloom prefilter written with every coordinate index, in bits per coordinate (0 disables the prefilter).
+    With a prefilter, index files are written with one, index files without one (or of another size) are stale, and loaded indexes
+    test reads against the prefilter first (see FilteredCoordIndex). 12 bits per coordinate give about 1% false positives.
+    Must be called in every worker process (e.g. in the multiprocessing.Pool initializer) for the setting to apply there.
+    Raises ValueError if bits_per_key is not between 0 and 64.
+    Usage example: configurePrefilter( bits_per_key = 12 )
+    """
+    if bits_per_key < 0 or bits_per_key > 64:
+        raise ValueError("The prefilter size must be between 0 and 64 bits per read coordinate.")
+    prefilter.update(bits_per_key=bits_per_key)
+
+def packReadCoordinates( coord_string ):
+    """
+    Packs a 'lane:tile:x:y' read coordinate string into a single 64-bit integer (see LANE_BITS, TILE_BITS, X_BITS, Y_BITS).
+    Fields after y (e.g. UMI) are ignored. Raises ValueError if a field does not fit its bit width.
+    Usage example: packReadCoordinates( coord_string = '1:1101:15589:1331' )
+    """
+    lane, tile, x, y = (int(i) for i in coord_string.split(sep=':')[:4])
+    if lane >> LANE_BITS or tile >> TILE_BITS or x >> X_BITS or y >> Y_BITS:
+        raise ValueError("Read coordinates "+coord_string+" do not fit the packed 64-bit layout.")
+    return((lane << (TILE_BITS+X_BITS+Y_BITS)) | (tile << (X_BITS+Y_BITS)) | (x << Y_BITS) | y)
+
+def packCoordinateArrays( lane, tile, x, y ):
+    """
+    Packs NumPy arrays of lane, tile, x and y read coordinates into a NumPy uint64 array (see packReadCoordinates).
+    Raises ValueError if a field does not fit its bit width.
+    Usage example: packCoordinateArrays( lane = np.array([1]), tile = np.array([1101]), x = np.array([15589]), y = np.array([1331]) )
+    """
+    if len(lane) and ((lane >> LANE_BITS).any() or (tile >> TILE_BITS).any() or (x >> X_BITS).any() or (y >> Y_BITS).any()):
+        raise ValueError("Read coordinates do not fit the packed 64-bit layout.")
+    return((lane.astype(np.uint64) << np.uint64(TILE_BITS+X_BITS+Y_BITS)) | (tile.astype(np.uint64) << np.uint64(X_BITS+Y_BITS))
+           | (x.astype(np.uint64) << np.uint64(Y_BITS)) | y.astype(np.uint64))
+
+def makeCoordIndex( packed ):
+    """
+    Makes a sorted NumPy array of unique packed 64-bit read coordinates from an array('Q') of packed read coordinates.
+    Takes ~8 bytes per read instead of one Python string per read in a set.
+    Usage example: makeCoordIndex( packed = array('Q', [packReadCoordinates('1:1101:15589:1331')]) )
+    """
+    if not packed:
+        return(np.empty(0, dtype=np.uint64))
+    coord_index=np.frombuffer(packed, dtype=np.uint64)
+    coord_index.sort()
+    # drop duplicated coordinates (same read in several project files)
+    keep=np.empty(len(coord_index), dtype=bool)
+    keep[0]=True
+    np.not_equal(coord_index[1:], coord_index[:-1], out=keep[1:])
+    return(coord_index[keep])
+
+def describeSourceFiles( file_list ):
+    """
+    Describes the source fastq files of a coordinate index by path, size and modification time. Returns a list of dicts sorted by path.
+    Usage example: describeSourceFiles( file_list = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'] )
+    """
+    sources=[]
+    for fq in sorted(os.path.abspath(i) for i in file_list):
+        st=os.stat(fq)
+        sources.append({'path': fq, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns})
+    return(sources)
+
+def writeCoordIndex( index_file, coord_index, source_files ):
+    """
+    Writes a sorted coordinate index to a binary index file: INDEX_MAGIC, the header length as little-endian uint64,
+    a JSON header (version, bit layout, count, source files) padded to 8 bytes, then the packed coordinates as little-endian uint64.
+    With a prefilter configured (see configurePrefilter), its Bloom filter follows as little-endian uint64 words.
+    The file is written to a temporary name and renamed, so an interrupted run never leaves a partial index behind.
+    Usage example: writeCoordIndex( index_file = 'L001read_coordinates_to_eliminate.idx', coord_index = makeCoordIndex(...), source_files = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'] )
+    """
+    bloom=makeBloomFilter(len(coord_index))
+    if bloom:
+        bloom.add(coord_index)
+    header_bytes=makeCoordIndexHeader(len(coord_index), describeSourceFiles(source_files), bloom=bloom)
+    tmp_file=index_file+'.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        coord_index.astype('<u8', copy=False).tofile(f)
+        if bloom:
+            bloom.words.astype('<u8', copy=False).tofile(f)
+    os.replace(tmp_file, index_file)
+
+def makeCoordIndexHeader( count, sources, min_length=0, bloom=None ):
+    """
+    Makes the JSON header of a binary index file for count coordinates built from sources (see describeSourceFiles) with the Bloom filter bloom if given,
+    padded with spaces to at least min_length bytes and so that the packed coordinates start on an 8-byte boundary.
+    Usage example: makeCoordIndexHeader( count = 1000, sources = describeSourceFiles(['/home/Proj_1/S1_L001_R1_001.fastq.gz']) )
+    """
+    header={'version': INDEX_VERSION,
+            'layout': [LANE_BITS, TILE_BITS, X_BITS, Y_BITS],
+            'count': count,
+            'sources': sources}
+    if bloom:
+        header['bloom']=bloom.describe()
+    header_bytes=json.dumps(header).encode()
+    header_bytes+=b' '*max(0, min_length-len(header_bytes))
+    header_bytes+=b' '*(-(len(INDEX_MAGIC)+8+len(header_bytes)) % 8)
+    return(header_bytes)
+
+def readCoordIndexHeader( index_file ):
+    """
+    Reads the header of a binary index file. Returns a tuple (header dict, offset of the packed coordinates),
+    or None if the file does not exist or is not a valid index file.
+    Usage example: readCoordIndexHeader( index_file = 'L001read_coordinates_to_eliminate.idx' )
+    """
+    try:
+        with open(index_file, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return(None)
+            header_length=int.from_bytes(f.read(8), 'little')
+            header=json.loads(f.read(header_length))
+    except (OSError, ValueError):
+        return(None)
+    offset=len(INDEX_MAGIC)+8+header_length
+    if os.path.getsize(index_file) != offset+8*header.get('count', -1)+8*header.get('bloom', {}).get('words', 0):
+        return(None)
+    return(header, offset)
+
+def isCoordIndexStale( index_file, source_files ):
+    """
+    Tests if a binary index file must be rebuilt: returns True if it is missing, invalid, written with another format or bit layout,
+    without the configured prefilter (see configurePrefilter), or if the source fastq files differ (paths, sizes or modification times) from the ones it was built from.
+    Usage example: isCoordIndexStale( index_file = 'L001read_coordinates_to_eliminate.idx', source_files = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'] )
+    """
+    header_offset=readCoordIndexHeader(index_file)
+    if header_offset is None:
+        return(True)
+    header=header_offset[0]
+    if header['version'] != INDEX_VERSION or header['layout'] != [LANE_BITS, TILE_BITS, X_BITS, Y_BITS]:
+        return(True)
+    if prefilter['bits_per_key'] and header.get('bloom', {}).get('bits_per_key') != prefilter['bits_per_key']:
+        return(True)
+    try:
+        return(header['sources'] != describeSourceFiles(source_files))
+    except OSError:
+        return(True)
+
+def loadCoordIndex( index_file ):
+    """
+    Memory-maps the packed coordinates of a binary index file read-only. Returns a sorted NumPy uint64 array backed by the file, or,
+    with a prefilter configured (see configurePrefilter) and saved in the file, a FilteredCoordIndex of the array and its Bloom filter.
+    Raises ValueError if the file is missing, truncated or not a valid index file.
+    Usage example: loadCoordIndex( index_file = 'L001read_coordinates_to_eliminate.idx' )
+    """
+    header_offset=readCoordIndexHeader(index_file)
+    if header_offset is None:
+        raise ValueError("File "+index_file+" is not a valid coordinate index.")
+    (header, offset)=header_offset
+    if header['count'] == 0:
+        coord_index=np.empty(0, dtype=np.uint64)
+    else:
+        coord_index=np.memmap(index_file, dtype='<u8', mode='r', offset=offset, shape=(header['count'],))
+    if prefilter['bits_per_key'] and 'bloom' in header:
+        words=np.memmap(index_file, dtype='<u8', mode='r', offset=offset+8*header['count'], shape=(header['bloom']['words'],))
+        return(FilteredCoordIndex(coord_index, BloomFilter(words, header['bloom']['hashes'], header['bloom']['bits_per_key'])))
+    return(coord_index)
+
+def inCoordIndex( coord_index, packed_coords ):
+    """
+    Tests a NumPy array of packed read coordinates against a sorted coordinate index (or a ShardedCoordIndex or FilteredCoordIndex) by binary search.
+    Returns a boolean array, True where the read coordinates are present in the index.
+    Usage example: inCoordIndex( coord_index = loadCoordIndex('L001read_coordinates_to_eliminate.idx'), packed_coords = np.array([...], dtype=np.uint64) )
+    """
+    if isinstance(coord_index, (ShardedCoordIndex, FilteredCoordIndex)):
+        return(coord_index.contains(packed_coords))
+    if len(coord_index) == 0:
+        return(np.zeros(len(packed_coords), dtype=bool))
+    pos=np.searchsorted(coord_index, packed_coords)
+    pos[pos == len(coord_index)]=0
+    return(coord_index[pos] == packed_coords)
+
+def spillSortedRun( run, run_dir, run_number, unique=True ):
+    """
+    Sorts a run of packed read coordinates in place, de-duplicates it (unless unique=False) and writes it to a temporary run file. Returns the path of the run file.
+    Usage example: spillSortedRun( run = np.array([3, 1, 2], dtype=np.uint64), run_dir = 'L001read_coordinates_to_eliminate.idx.runs', run_number = 0 )
+    """
+    run.sort()
+    run_file=os.path.join(run_dir, 'run%05d.u64' % run_number)
+    if len(run):
+        (run[np.concatenate(([True], run[1:] != run[:-1]))] if unique else run).astype('<u8', copy=False).tofile(run_file)
+    else:
+        open(run_file, 'wb').close()
+    return(run_file)
+
+def mergeSortedRuns( run_files, block_size, unique=True ):
+    """
+    Merges sorted run files of packed read coordinates. Yields sorted NumPy blocks in increasing order, de-duplicated unless unique=False,
+    reading at most block_size coordinates per run at a time. Each round emits every coordinate up to the smallest last value of the
+    blocks in memory, which is safe since the runs are sorted.
+    Usage example: for block in mergeSortedRuns( run_files = ['run00000.u64', 'run00001.u64'], block_size = 1<<20 ): ...
+    """
+    handles=[open(i, 'rb') for i in run_files]
+    try:
+        blocks=[np.fromfile(f, dtype='<u8', count=block_size) for f in handles]
+        while True:
+            active=[i for i in range(len(blocks)) if len(blocks[i])]
+            if not active:
+                break
+            bound=min(blocks[i][-1] for i in active)
+            parts=[]
+            for i in active:
+                cut=np.searchsorted(blocks[i], bound, side='right')
+                parts.append(blocks[i][:cut])
+                blocks[i]=blocks[i][cut:]
+                if len(blocks[i]) == 0:
+                    blocks[i]=np.fromfile(handles[i], dtype='<u8', count=block_size)
+            merged=np.sort(np.concatenate(parts))
+            yield(merged[np.concatenate(([True], merged[1:] != merged[:-1]))] if unique else merged)
+    finally:
+        for f in handles:
+            f.close()
+
+def writeCoordIndexFromRuns( index_file, run_files, source_files, max_memory ):
+    """
+    Writes the binary index file (see writeCoordIndex) of the merged run files without holding all coordinates in memory.
+    The header is first written with the total size of the runs as count (an upper bound) and rewritten in place, padded to the
+    same length, with the number of unique coordinates once the merge is done. A prefilter (see configurePrefilter) is sized for the upper bound,
+    filled block by block and written after the coordinates. Returns the number of unique coordinates.
+    Usage example: writeCoordIndexFromRuns( index_file = 'L001read_coordinates_to_eliminate.idx', run_files = ['run00000.u64'], source_files = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'], max_memory = 2<<30 )
+    """
+    sources=describeSourceFiles(source_files)
+    upper_bound=sum(os.path.getsize(i) for i in run_files)//8
+    bloom=makeBloomFilter(upper_bound)
+    header_bytes=makeCoordIndexHeader(upper_bound, sources, bloom=bloom)
+    # room for the false-positive rate of the filled prefilter
+    header_bytes+=b' '*(32 if bloom else 0)
+    block_size=max(max_memory//24//max(len(run_files), 1), 4096)
+    count=0
+    tmp_file=index_file+'.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(INDEX_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for block in mergeSortedRuns(run_files, block_size):
+            block.tofile(f)
+            count+=len(block)
+            if bloom:
+                bloom.add(block)
+        if bloom:
+            bloom.words.astype('<u8', copy=False).tofile(f)
+        f.seek(len(INDEX_MAGIC)+8)
+        f.write(makeCoordIndexHeader(count, sources, min_length=len(header_bytes), bloom=bloom))
+    os.replace(tmp_file, index_file)
+    return(count)
+
+def mergeJoinCoordIndex( coord_index, window, packed ):
+    """
+    Tests packed read coordinates against a memory-mapped coord_index without reading more than window index values at a time:
+    the sorted coordinates are merge-joined with windows of the index range they span, every window starting at the first index value
+    not below the next coordinate to test, so that stretches of the index without read coordinates are skipped instead of read.
+    Returns a boolean array, True where the read coordinates are present in the index.
+    Usage example: mergeJoinCoordIndex( coord_index = loadCoordIndex('L001read_coordinates_to_eliminate.idx'), window = 1<<20, packed = np.array([...], dtype=np.uint64) )
+    """
+    present=np.zeros(len(packed), dtype=bool)
+    if isinstance(coord_index, FilteredCoordIndex):
+        # only the reads passed by the prefilter are merge-joined
+        passed=coord_index.prefilter(packed)
+        present[passed]=mergeJoinCoordIndex(coord_index.coord_index, window, packed[passed])
+        coord_index.count(present)
+        return(present)
+    if len(packed) == 0 or len(coord_index) == 0:
+        return(present)
+    order=np.argsort(packed, kind='stable')
+    keys=packed[order]
+    # index range spanned by the batch, then merge window by window
+    (start, stop)=np.searchsorted(coord_index, [keys[0], keys[-1]], side='left')
+    stop=min(stop+1, len(coord_index))
+    k=0
+    while start < stop and k < len(keys):
+        values=np.array(coord_index[start:min(start+window, stop)])
+        end=np.searchsorted(keys, values[-1], side='right')
+        present[order[k:end]]=inCoordIndex(values, keys[k:end])
+        k=end
+        if k < len(keys):
+            # skip to the next coordinate: all values of the window are below it
+            start=int(np.searchsorted(coord_index, keys[k], side='left'))
+    return(present)
+
+def groupByTile( packed ):
+    """
+    Groups packed read coordinates by tile. Returns a list of tuples (tile name '<lane>_<tile>', positions of its coordinates in packed),
+    in tile order, the positions of a tile being in their order in packed.
+    Usage example: groupByTile( packed = np.array([packReadCoordinates('1:1101:15589:1331')], dtype=np.uint64) )
+    """
+    if len(packed) == 0:
+        return([])
+    keys=packed >> np.uint64(X_BITS+Y_BITS)
+    order=np.argsort(keys, kind='stable')
+    groups=np.split(order, np.flatnonzero(np.diff(keys[order]))+1)
+    return([('%d_%d' % (int(keys[i[0]]) >> TILE_BITS, int(keys[i[0]]) & ((1 << TILE_BITS)-1)), i) for i in groups])
+
+def isShardedIndexStale( index_dir, source_files ):
+    """
+    Tests if a sharded index folder (see ShardedCoordIndex) must be rebuilt: returns True if it is missing or empty, or if any of its
+    tile index files is stale (see isCoordIndexStale).
+    Usage example: isShardedIndexStale( index_dir = 'L001read_coordinates_to_eliminate.tiles', source_files = ['/home/Proj_1/S1_L001_R1_001.fastq.gz'] )
+    """
+    if not os.path.isdir(index_dir):
+        return(True)
+    shards=[i for i in os.listdir(index_dir) if i.endswith(SHARD_SUFFIX)]
+    return(not shards or any(isCoordIndexStale(os.path.join(index_dir, i), source_files) for i in shards))
+
+def makeBloomFilter( count ):
+    """
+    Makes an empty Bloom filter for count coordinates with the configured number of bits per coordinate (see configurePrefilter).
+    Returns None if no prefilter is configured.
+    Usage example: makeBloomFilter( count = 1000000 )
+    """
+    bits_per_key=prefilter['bits_per_key']
+    if not bits_per_key:
+        return(None)
+    words=np.zeros(max(1, -(-count*bits_per_key//64)), dtype=np.uint64)
+    # bits_per_key/2 bits per coordinate is about optimal for 64-bit blocks (fewer than bits_per_key*ln(2) for a classic Bloom filter),
+    # at most 10 bit positions of 6 bits in a 64-bit hash
+    return(BloomFilter(words, max(1, min(10, bits_per_key//2)), bits_per_key))
+
+def mixBits( packed ):
+    """
+    Hashes a NumPy array of 64-bit integers to well-mixed 64-bit integers (splitmix64 finalizer).
+    Usage example: mixBits( packed = np.array([packReadCoordinates('1:1101:15589:1331')], dtype=np.uint64) )
+    """
+    z=packed.astype(np.uint64)+np.uint64(0x9e3779b97f4a7c15)
+    z=(z ^ (z >> np.uint64(30)))*np.uint64(0xbf58476d1ce4e5b9)
+    z=(z ^ (z >> np.uint64(27)))*np.uint64(0x94d049bb133111eb)
+    return(z ^ (z >> np.uint64(31)))
+
+#############################################################################
+# Classes
+#############################################################################
+class ShardedCoordIndex:
+    """
+    Coordinate index of a lane sharded by tile: a folder with one binary index file (see writeCoordIndex) per tile, named <lane>_<tile>.idx.
+    Reads are routed to the index of their tile, memory-mapped when first needed; at most max_resident tile indexes are kept mapped at
+    once, the least recently used being unmapped first, so that memory follows the size of a tile rather than of the lane.
+    Tiles without an index file have no reads to remove. Raises ValueError if max_resident is below 1.
+    Usage example: coord_index=ShardedCoordIndex( index_dir = 'L001read_coordinates_to_eliminate.tiles', max_resident = 4 ); inCoordIndex(coord_index, packed)
+    """
+    def __init__( self, index_dir, max_resident=4 ):
+        if max_resident < 1:
+            raise ValueError("The number of resident tile indexes must be at least 1.")
+        self.index_dir=index_dir
+        self.max_resident=max_resident
+        self.tiles=set(i[:-len(SHARD_SUFFIX)] for i in os.listdir(index_dir) if i.endswith(SHARD_SUFFIX))
+        self.resident=OrderedDict()
+        self.loads=0
+
+    def __len__( self ):
+        return(sum(readCoordIndexHeader(self.shardFile(i))[0]['count'] for i in self.tiles))
+
+    def shardFile( self, tile ):
+        """
+        Returns the path of the index file of tile.
+        """
+        return(os.path.join(self.index_dir, tile+SHARD_SUFFIX))
+
+    def shard( self, tile ):
+        """
+        Returns the sorted coordinate index of tile, memory-mapping it (and unmapping the least recently used one) if needed.
+        """
+        if tile not in self.tiles:
+            return(np.empty(0, dtype=np.uint64))
+        if tile in self.resident:
+            self.resident.move_to_end(tile)
+        else:
+            if len(self.resident) >= self.max_resident:
+                self.resident.popitem(last=False)
+            self.resident[tile]=loadCoordIndex(self.shardFile(tile))
+            self.loads+=1
+        return(self.resident[tile])
+
+    def contains( self, packed_coords ):
+        """
+        Tests a NumPy array of packed read coordinates against the indexes of their tiles. Returns a boolean array, True where present.
+        """
+        present=np.zeros(len(packed_coords), dtype=bool)
+        for (tile, idx) in groupByTile(packed_coords):
+            present[idx]=inCoordIndex(self.shard(tile), packed_coords[idx])
+        return(present)
+
+class BloomFilter:
+    """
+    Blocked Bloom filter of packed read coordinates: every coordinate sets hashes bits in one 64-bit word of words, chosen by a hash
+    of the coordinate, so that adding or testing a coordinate touches a single word. Never misses a coordinate that was added;
+    the false-positive rate depends on the bits per coordinate (see falsePositiveRate).
+    Usage example: bloom=makeBloomFilter( count = len(coord_index) ); bloom.add(coord_index); bloom.mayContain(packed)
+    """
+    def __init__( self, words, hashes, bits_per_key ):
+        self.words=words
+        self.hashes=hashes
+        self.bits_per_key=bits_per_key
+
+    def locate( self, packed ):
+        """
+        Returns the words and the bit masks of packed read coordinates.
+        """
+        h=mixBits(packed)
+        position=h % np.uint64(len(self.words))
+        h=mixBits(h)
+        mask=np.zeros(len(h), dtype=np.uint64)
+        for i in range(self.hashes):
+            mask|=np.uint64(1) << ((h >> np.uint64(6*i)) & np.uint64(63))
+        return(position, mask)
+
+    def add( self, packed, block_size=1<<20 ):
+        """
+        Adds packed read coordinates, block_size at a time.
+        """
+        for i in range(0, len(packed), block_size):
+            (position, mask)=self.locate(packed[i:i+block_size])
+            np.bitwise_or.at(self.words, position, mask)
+
+    def mayContain( self, packed ):
+        """
+        Tests packed read coordinates. Returns a boolean array, False where a coordinate was certainly not added.
+        """
+        (position, mask)=self.locate(packed)
+        return((self.words[position] & mask) == mask)
+
+    def falsePositiveRate( self, block_size=1<<20 ):
+        """
+        Estimates the false-positive rate from the fill of the words: the mean over words of (set bits/64)^hashes.
+        """
+        total=0.0
+        for i in range(0, len(self.words), block_size):
+            ones=np.unpackbits(np.ascontiguousarray(self.words[i:i+block_size]).view(np.uint8)).reshape(-1, 64).sum(axis=1)
+            total+=float(((ones/64.0)**self.hashes).sum())
+        return(total/len(self.words))
+
+    def describe( self ):
+        """
+        Returns the description of the filter saved in the index file header.
+        """
+        return({'words': len(self.words), 'hashes': self.hashes, 'bits_per_key': self.bits_per_key, 'fpr': round(self.falsePositiveRate(), 6)})
+
+class FilteredCoordIndex:
+    """
+    Sorted coordinate index with its Bloom prefilter (see loadCoordIndex): reads are tested against the prefilter first and only those
+    it passes are searched in the index, so that the result is exact. The reads tested, passed and present are added to prefilter_stats.
+    Usage example: coord_index=FilteredCoordIndex( coord_index = coord_array, bloom = bloom ); inCoordIndex(coord_index, packed)
+    """
+    def __init__( self, coord_index, bloom ):
+        self.coord_index=coord_index
+        self.bloom=bloom
+
+    def __len__( self ):
+        return(len(self.coord_index))
+
+    def prefilter( self, packed_coords ):
+        """
+        Returns a boolean array, True where packed read coordinates pass the prefilter, and counts them in prefilter_stats.
+        """
+        passed=self.bloom.mayContain(packed_coords)
+        prefilter_stats['tested']+=len(packed_coords)
+        prefilter_stats['passed']+=int(np.count_nonzero(passed))
+        return(passed)
+
+    def count( self, present ):
+        """
+        Counts the reads found in the index in prefilter_stats.
+        """
+        prefilter_stats['present']+=int(np.count_nonzero(present))
+
+    def contains( self, packed_coords ):
+        """
+        Tests a NumPy array of packed read coordinates. Returns a boolean array, True where present in the index.
+        """
+        passed=self.prefilter(packed_coords)
+        present=np.zeros(len(packed_coords), dtype=bool)
+        present[passed]=inCoordIndex(self.coord_index, packed_coords[passed])
+        self.count(present)
+        return(present)
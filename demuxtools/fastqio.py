@@ -0,0 +1,241 @@
+#############################################################################
+### Pluggable compression layer for FASTQ.GZ input and output.
+###
+### Decompression backends (read):
+###   gzip    : python gzip module (always available)
+###   isal    : python-isal, decompression in a helper thread (if installed)
+###   zlib-ng : python-zlib-ng, decompression in a helper thread (if installed)
+###   pipe    : igzip/pigz/gzip -dc helper process piped in (if on the PATH)
+###   auto    : first available of isal, zlib-ng, pipe, gzip
+###
+### Compression backends (write):
+###   gzip    : python gzip module, single thread
+###   bgzf    : BGZF blocks (concatenated gzip members readable by any gzip
+###             reader) compressed in parallel by a thread pool
+###   isal    : python-isal, multithreaded (levels are capped at 3)
+###   zlib-ng : python-zlib-ng, multithreaded
+#############################################################################
+
+import gzip
+import io
+import shutil
+import subprocess
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#############################################################################
+# Variables
+#############################################################################
+READ_BACKENDS=('auto', 'gzip', 'isal', 'zlib-ng', 'pipe')
+WRITE_BACKENDS=('gzip', 'bgzf', 'isal', 'zlib-ng')
+# helper programs for the 'pipe' read backend, in order of preference
+PIPE_PROGRAMS=('igzip', 'pigz', 'gzip')
+# BGZF: uncompressed bytes per block (as samtools/htslib) and the empty end-of-file block
+BGZF_BLOCK_SIZE=0xff00
+BGZF_EOF=bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# current settings, see configureCompression
+compression={'read_backend': 'auto', 'write_backend': 'gzip', 'level': 9, 'threads': 1}
+
+#############################################################################
+# Functions
+#############################################################################
+def configureCompression( read_backend='auto', write_backend='gzip', level=9, threads=1 ):
+    """
+    Sets the compression backends, compression level and number of compression threads used by openFastq.
+    Must be called in every worker process (e.g. as multiprocessing.Pool initializer) for the settings to apply there.
+    Usage example: configureCompression( read_backend = 'auto', write_backend = 'bgzf', level = 6, threads = 8 )
+    """
+    if read_backend not in READ_BACKENDS:
+        raise ValueError("Unknown decompression backend "+read_backend+"; use one of "+', '.join(READ_BACKENDS)+".")
+    if write_backend not in WRITE_BACKENDS:
+        raise ValueError("Unknown compression backend "+write_backend+"; use one of "+', '.join(WRITE_BACKENDS)+".")
+    compression.update(read_backend=read_backend, write_backend=write_backend, level=level, threads=threads)
+
+def availableReadBackends():
+    """
+    Lists the decompression backends usable in this environment, in the order 'auto' tries them.
+    Usage example: availableReadBackends()
+    """
+    backends=[]
+    for name, module in (('isal', 'isal.igzip_threaded'), ('zlib-ng', 'zlib_ng.gzip_ng_threaded')):
+        try:
+            __import__(module)
+            backends.append(name)
+        except ImportError:
+            pass
+    if pipeProgram():
+        backends.append('pipe')
+    backends.append('gzip')
+    return(backends)
+
+def availableWriteBackends():
+    """
+    Lists the compression backends usable in this environment.
+    Usage example: availableWriteBackends()
+    """
+    return([i for i in WRITE_BACKENDS if i in ('gzip', 'bgzf') or i in availableReadBackends()])
+
+def pipeProgram():
+    """
+    Returns the path of the first helper decompression program of PIPE_PROGRAMS found on the PATH, or None.
+    Usage example: pipeProgram()
+    """
+    for program in PIPE_PROGRAMS:
+        path=shutil.which(program)
+        if path:
+            return(path)
+    return(None)
+
+def openFastq( file, mode='rt', read_backend=None, write_backend=None, level=None, threads=None ):
+    """
+    Opens a FASTQ.GZ file for reading ('rt', 'rb') or writing ('wt', 'wb') with the configured backends (see configureCompression);
+    keyword arguments override the configured settings for this file.
+    Usage example: with openFastq( file = 'Undetermined_S0_L001_R1_001.fastq.gz', mode = 'rt' ) as fq: ...
+    """
+    if mode not in ('rt', 'rb', 'wt', 'wb'):
+        raise ValueError("Unsupported mode "+mode+" for "+file+".")
+    if mode[0] == 'r':
+        handle=openReader(file, read_backend or compression['read_backend'])
+    else:
+        handle=openWriter(file, write_backend or compression['write_backend'],
+                          compression['level'] if level is None else level,
+                          threads or compression['threads'])
+    if mode[1] == 't':
+        return(io.TextIOWrapper(handle, encoding='utf-8'))
+    return(handle)
+
+def fastqRecords( handle ):
+    """
+    Iterates over the (title, sequence, quality) records of a FASTQ file opened in text mode. Biopython is imported on first use
+    only, so that commands that do not parse records do not pay for its import.
+    Usage example: for (title, seq, qual) in fastqRecords( handle = openFastq('Undetermined_S0_L001_R1_001.fastq.gz', 'rt') ): ...
+    """
+    from Bio.SeqIO.QualityIO import FastqGeneralIterator
+    return(FastqGeneralIterator(handle))
+
+def openReader( file, backend ):
+    """
+    Opens a FASTQ.GZ file for binary reading with the decompression backend backend.
+    Usage example: openReader( file = 'Undetermined_S0_L001_R1_001.fastq.gz', backend = 'pipe' )
+    """
+    if backend == 'auto':
+        backend=availableReadBackends()[0]
+    if backend == 'isal':
+        from isal import igzip_threaded
+        return(igzip_threaded.open(file, 'rb', threads=1))
+    if backend == 'zlib-ng':
+        from zlib_ng import gzip_ng_threaded
+        return(gzip_ng_threaded.open(file, 'rb', threads=1))
+    if backend == 'pipe':
+        program=pipeProgram()
+        if program is None:
+            raise OSError("None of "+', '.join(PIPE_PROGRAMS)+" found on the PATH for the 'pipe' decompression backend.")
+        return(io.BufferedReader(PipeReader(program, file), buffer_size=1 << 20))
+    return(gzip.open(file, 'rb'))
+
+def openWriter( file, backend, level, threads ):
+    """
+    Opens a FASTQ.GZ file for binary writing with the compression backend backend, compression level level and threads compression threads.
+    Usage example: openWriter( file = 'Undetermined_clean_S0_L001_R1_001.fastq.gz', backend = 'bgzf', level = 6, threads = 8 )
+    """
+    if backend == 'bgzf':
+        return(BgzfWriter(open(file, 'wb'), level=level, threads=threads))
+    if backend == 'isal':
+        from isal import igzip_threaded
+        return(igzip_threaded.open(file, 'wb', compresslevel=min(level, 3), threads=threads))
+    if backend == 'zlib-ng':
+        from zlib_ng import gzip_ng_threaded
+        return(gzip_ng_threaded.open(file, 'wb', compresslevel=level, threads=threads))
+    return(gzip.open(file, 'wb', compresslevel=level))
+
+#############################################################################
+# Classes
+#############################################################################
+class PipeReader(io.RawIOBase):
+    """
+    Raw binary stream of a file decompressed by a helper process (program -dc file), so that decompression runs on another core.
+    Raises OSError at the end of the stream if the helper process failed.
+    Usage example: io.BufferedReader(PipeReader( program = '/usr/bin/pigz', file = 'Undetermined_S0_L001_R1_001.fastq.gz' ))
+    """
+    def __init__( self, program, file ):
+        self.file=file
+        self.process=subprocess.Popen([program, '-dc', file], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def readable( self ):
+        return(True)
+
+    def readinto( self, b ):
+        n=self.process.stdout.readinto(b)
+        if n == 0 and self.process.wait() != 0:
+            raise OSError("Decompression of "+self.file+" failed: "+self.process.stderr.read().decode().strip())
+        return(n)
+
+    def close( self ):
+        if not self.closed:
+            self.process.stdout.close()
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+            self.process.stderr.close()
+        super().close()
+
+class BgzfWriter(io.BufferedIOBase):
+    """
+    Writes BGZF: the data is cut into blocks of BGZF_BLOCK_SIZE bytes, each compressed into its own gzip member by a pool of threads
+    (zlib releases the GIL) and written in order. The output is a valid multi-member gzip file ending with the BGZF end-of-file block.
+    Usage example: BgzfWriter( fileobj = open('Undetermined_clean_S0_L001_R1_001.fastq.gz', 'wb'), level = 6, threads = 8 )
+    """
+    def __init__( self, fileobj, level=6, threads=1 ):
+        self.fileobj=fileobj
+        self.level=level
+        self.buffer=bytearray()
+        self.pool=ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        # compressed blocks not yet written, bounded to keep memory use flat
+        self.pending=deque()
+        self.max_pending=4*threads
+
+    def writable( self ):
+        return(True)
+
+    def write( self, b ):
+        self.buffer+=b
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            block=bytes(self.buffer[:BGZF_BLOCK_SIZE])
+            del self.buffer[:BGZF_BLOCK_SIZE]
+            self.submitBlock(block)
+        return(len(b))
+
+    def submitBlock( self, block ):
+        if self.pool is None:
+            self.fileobj.write(compressBgzfBlock(block, self.level))
+            return
+        self.pending.append(self.pool.submit(compressBgzfBlock, block, self.level))
+        while len(self.pending) > self.max_pending or (self.pending and self.pending[0].done()):
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close( self ):
+        if not self.closed:
+            if self.buffer:
+                self.submitBlock(bytes(self.buffer))
+                self.buffer=bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.fileobj.write(BGZF_EOF)
+            self.fileobj.close()
+        super().close()
+
+def compressBgzfBlock( data, level ):
+    """
+    Compresses up to BGZF_BLOCK_SIZE bytes into one BGZF block (gzip member with the 'BC' extra field holding the block size).
+    Usage example: compressBgzfBlock( data = fastq_bytes[:BGZF_BLOCK_SIZE], level = 6 )
+    """
+    compressor=zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata=compressor.compress(data)+compressor.flush()
+    block_size=18+len(cdata)+8
+    header=b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'+(block_size-1).to_bytes(2, 'little')
+    trailer=zlib.crc32(data).to_bytes(4, 'little')+len(data).to_bytes(4, 'little')
+    return(header+cdata+trailer)
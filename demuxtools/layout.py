@@ -0,0 +1,264 @@
+#############################################################################
+### Run layout of a DEMUX run folder, parsed once from master_demux.conf.
+###
+### RunLayout holds the demultiplexings of the run (unaligned suffix ->
+### sample projects), the project and Undetermined folders, and an index of
+### their files by (unaligned suffix, project, lane, read), built from one
+### os.scandir pass over the folders, so that every step of the DEMUX tools
+### asks the same object instead of re-reading the config and re-listing
+### the folders for every lane. loadRunLayout returns the same object for
+### the same, unchanged config.
+###
+### With the listing cache enabled (see configureListingCache), the folder
+### listings are also saved in the run folder and reused by later runs of
+### any tool as long as the modification time of the folder is unchanged,
+### which saves listing folders of thousands of files on a network
+### filesystem (GPFS, NFS).
+###
+### Standard library only: importing this module is cheap.
+#############################################################################
+
+import fnmatch
+import json
+import os
+import re
+import sys
+from itertools import groupby
+
+from demuxtools.log import printMsg
+
+#############################################################################
+# Variables
+#############################################################################
+LANES=('L001', 'L002', 'L003', 'L004')
+# project fastqs the lane indexes of the clean command are made of
+READ1_PATTERN='*_R1_00?.fastq.gz'
+# parsed layouts, see loadRunLayout
+layouts={}
+# current settings, see configureListingCache
+listing_cache={'enabled': False}
+# folder listings cache file, in the DEMUX_RUN directory
+LISTING_CACHE_NAME='.demuxtools.listings.json'
+LISTING_CACHE_VERSION=1
+# lane and read of a fastq name, anchored to the bcl2fastq suffix, e.g. S1_S1_L001_R1_001.fastq.gz; the lane of other file names
+FASTQ_TAGS=re.compile(r'_(L\d{3})_(R[1-3]|I[12])_\d{3}\.fastq\.gz$')
+LANE_TAG=re.compile(r'_(L\d{3})_')
+
+#############################################################################
+# Functions
+#############################################################################
+def loadRunLayout( config_file, verbose=True ):
+    """
+    Returns the RunLayout of config_file, parsed on first use and then cached as long as the config file is unchanged.
+    With verbose=True, the config file and the project paths are reported when the config is parsed.
+    Usage example: loadRunLayout( config_file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf' )
+    """
+    if not os.access(config_file, mode=os.R_OK):
+        sys.exit("[FATAL] File "+config_file+" does not exist or is not readable.")
+    key=(os.path.abspath(config_file), os.stat(config_file).st_mtime_ns)
+    if key not in layouts:
+        layouts[key]=RunLayout(config_file)
+        if verbose:
+            layouts[key].report()
+    return(layouts[key])
+
+def configureListingCache( enabled=False ):
+    """
+    Sets whether the folder listings of a run are saved to and reused from LISTING_CACHE_NAME in its DEMUX_RUN directory (see scanDir).
+    Applies to the layouts loaded afterwards.
+    Usage example: configureListingCache( enabled = True )
+    """
+    listing_cache.update(enabled=enabled)
+
+def scanDir( path, cache=None ):
+    """
+    Returns the sorted names of the files of folder path, listed with os.scandir. With cache, a dict {folder: {'mtime_ns', 'files'}},
+    the listing saved for path is returned if the modification time of the folder is unchanged (no file added, removed or renamed);
+    otherwise the folder is listed and its listing saved in cache. Returns a tuple (file names, True if cache was changed).
+    Usage example: scanDir( path = '/work/.../DEMUX/221014_JABBA113_AXXXXX/UnalignedBCL1/Undetermined' )
+    """
+    if cache is not None:
+        # taken before listing: a file added while listing changes it for the next run
+        mtime_ns=os.stat(path).st_mtime_ns
+        if path in cache and cache[path]['mtime_ns'] == mtime_ns:
+            return(cache[path]['files'], False)
+    with os.scandir(path) as entries:
+        files=sorted(i.name for i in entries if i.is_file())
+    if cache is not None:
+        cache[path]={'mtime_ns': mtime_ns, 'files': files}
+    return(files, cache is not None)
+
+def loadListingCache( cache_file ):
+    """
+    Returns the folder listings saved in cache_file (see scanDir), or an empty dict if it does not exist or is invalid.
+    Usage example: loadListingCache( cache_file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/.demuxtools.listings.json' )
+    """
+    try:
+        with open(cache_file, 'r') as f:
+            cache=json.load(f)
+    except (OSError, ValueError):
+        return({})
+    return(cache.get('folders', {}) if cache.get('version') == LISTING_CACHE_VERSION else {})
+
+def saveListingCache( cache_file, cache ):
+    """
+    Saves the folder listings cache to cache_file, through a temporary file renamed into place so that concurrent runs never read a partial file.
+    Does nothing if the run folder is not writable.
+    Usage example: saveListingCache( cache_file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/.demuxtools.listings.json', cache = {} )
+    """
+    tmp_file=cache_file+'.'+str(os.getpid())
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump({'version': LISTING_CACHE_VERSION, 'folders': cache}, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        printMsg("Could not save the folder listings cache "+cache_file+".")
+
+def fastqTags( name ):
+    """
+    Returns the lane and read of a fastq file name, taken from its bcl2fastq suffix _L00N_<read>_00N.fastq.gz (e.g. ('L001', 'R1') for
+    Mouse_L002_S3_L001_R1_001.fastq.gz). For a name without that suffix, the read is None and the lane the last _L00N_ of the name, or None.
+    Usage example: fastqTags( name = 'Undetermined_S0_L001_I1_001.fastq.gz' )
+    """
+    tags=FASTQ_TAGS.search(name)
+    if tags:
+        return(tags.group(1), tags.group(2))
+    lanes=LANE_TAG.findall(name)
+    return(lanes[-1] if lanes else None, None)
+
+def extractReadCoordinates( header_string ):
+    """
+    Process a read header string to extract the read coordinates. Returns read coordinates separated by ':'.
+    Usage example: extractReadCoordinates( string = 'my_header_string' )
+    """
+    ss = ':'.join(header_string.split(None)[0].split(sep=':')[3:])
+    return(ss)
+
+def extractTile( coord ):
+    """
+    Process a read header read coordinate string to extract the tile. Returns tile name separated by '_:'.
+    Usage example: extractTile( string = 'my_read_coordinates' )
+    """
+    tt = '_'.join(coord.split(":")[:2])
+    return(tt)
+
+#############################################################################
+# Classes
+#############################################################################
+class RunLayout:
+    """
+    Layout of a DEMUX run folder declared by its master_demux.conf config file:
+    - root: the DEMUX_RUN folder (folder of the config file);
+    - demuxes: {unaligned suffix: [sample projects]} in config order;
+    - project_paths: the Unaligned<suffix>/<project> folders, in config order.
+    The files of the project and Undetermined folders are listed once and indexed (see fileIndex): files added to the run folder afterwards are not seen.
+    Usage example: layout=RunLayout( config_file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf' ); layout.read1Files('*_R1_00?.fastq.gz', 'L001')
+    """
+    def __init__( self, config_file ):
+        self.config_file=config_file
+        self.root=os.path.dirname(config_file) or '.'
+        self.demuxes={}
+        # read config file
+        with open(config_file, 'r') as f:
+            for line in f:
+                if not line.isspace():
+                    if line.strip().split(sep="=")[0] == "unaligned_suffix":
+                        suffix=line.strip().split(sep="=")[1]
+                    elif line.strip().split(sep="=")[0] == "sample_project":
+                        self.demuxes[suffix]=line.strip().split(sep="=")[1].split(sep=",")
+        self.project_paths=[self.root+'/Unaligned'+suffix+'/'+project for (suffix, projects) in self.demuxes.items() for project in projects]
+        self.listings={}
+        self.index=None
+        self.cache_changed=False
+        self.cache_file=self.runFile(LISTING_CACHE_NAME) if listing_cache['enabled'] else None
+        self.cache=loadListingCache(self.cache_file) if self.cache_file else None
+
+    def report( self ):
+        """
+        Prints the config file and the Unaligned project paths.
+        """
+        printMsg("Processing the following config file :")
+        print(self.config_file, "\n", sep="")
+        printMsg("Unaligned project paths :")
+        print('\n'.join(self.project_paths), '\n')
+
+    def listDir( self, path ):
+        """
+        Returns the sorted file names of folder path, listed once (see scanDir) and cached.
+        """
+        if path not in self.listings:
+            (self.listings[path], changed)=scanDir(path, self.cache)
+            self.cache_changed|=changed
+        return(self.listings[path])
+
+    def folders( self ):
+        """
+        Returns the project and Undetermined folders of the run as tuples (unaligned suffix, project, path), the project being
+        'Undetermined' for the Undetermined folders: project folders in config order, then the Undetermined folders.
+        """
+        folders=[(suffix, project, self.root+'/Unaligned'+suffix+'/'+project) for (suffix, projects) in self.demuxes.items() for project in projects]
+        return(folders+[(suffix, 'Undetermined', self.root+'/Unaligned'+suffix+'/Undetermined') for (suffix, projects) in self.demuxes.items() if projects])
+
+    def fileIndex( self ):
+        """
+        Returns the index of the files of the run: {(unaligned suffix, project, lane, read): [sorted paths]} (see folders), lane or read
+        being None for a file name without one (see fastqTags). Built on first use from one listing of every folder and saved to the
+        listing cache if enabled (see configureListingCache).
+        """
+        if self.index is None:
+            self.index={}
+            for (suffix, project, path) in self.folders():
+                for name in self.listDir(path):
+                    self.index.setdefault((suffix, project)+fastqTags(name), []).append(path+'/'+name)
+            if self.cache_changed:
+                saveListingCache(self.cache_file, self.cache)
+                self.cache_changed=False
+        return(self.index)
+
+    def indexedFiles( self, lane=None, read=None, undetermined=False ):
+        """
+        Returns the files of the project folders (of the Undetermined folders if undetermined=True) of lane lane and read read (None for any),
+        from the file index (see fileIndex): folder by folder in config order, sorted within a folder.
+        """
+        files=[]
+        # the keys of a folder are contiguous in the index
+        for ((suffix, project), items) in groupby(self.fileIndex().items(), key=lambda i: i[0][:2]):
+            if (project == 'Undetermined') == undetermined:
+                files+=sorted(i for ((_, _, file_lane, file_read), paths) in items if lane in (None, file_lane) and read in (None, file_read) for i in paths)
+        return(files)
+
+    def runFile( self, name ):
+        """
+        Returns the path of file name in the DEMUX_RUN folder.
+        """
+        return(self.root+'/'+name)
+
+    def projectFastqs( self, pattern='*fastq.gz' ):
+        """
+        Returns the files of all project folders that match pattern, folder by folder in config order.
+        """
+        return(fnmatch.filter(self.indexedFiles(), pattern))
+
+    def read1Files( self, pattern, lane=None ):
+        """
+        Returns the project fastqs that match pattern (e.g. '*_R1_00?.fastq.gz'), of lane lane only if given (e.g. 'L001').
+        """
+        return(fnmatch.filter(fnmatch.filter(self.indexedFiles(lane), '*fastq.gz'), pattern))
+
+    def lanes( self, pattern ):
+        """
+        Returns the lanes (of LANES) that have project fastqs matching pattern.
+        """
+        return([lane for lane in LANES if self.read1Files(pattern, lane)])
+
+    def undeterminedFolders( self ):
+        """
+        Returns the Undetermined folders of the Unaligned folders of the run, in config order.
+        """
+        return([path for (suffix, project, path) in self.folders() if project == 'Undetermined'])
+
+    def undeterminedFastqs( self, lane ):
+        """
+        Returns the sorted Undetermined fastq.gz files of lane lane (e.g. 'L001') of all Undetermined folders.
+        """
+        return(sorted(fnmatch.filter(self.indexedFiles(lane, undetermined=True), '*gz')))
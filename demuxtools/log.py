@@ -0,0 +1,17 @@
+#############################################################################
+### Log messages of the DEMUX tools.
+#############################################################################
+
+from datetime import datetime as dt
+
+#############################################################################
+# Functions
+#############################################################################
+# print information message
+def printMsg ( text ):
+    """
+    Prints a message in a pre-defined format for log purpose. If more than one string is used, 
+    concatenate strings with '+' as in Usage example below.
+    Usage example: printMsg( text = "This is the message for processing file "+myFile )
+    """
+    print("[INFO] [",dt.now().strftime('%Y/%m/%d %H:%M:%S').strip("\s"),"] ", text, "\n", sep="")
@@ -0,0 +1,136 @@
+#############################################################################
+### Checkpoint manifest for resumable runs.
+###
+### A JSON file records, per finished step (e.g. one cleaned Undetermined
+### fastq), the size and modification time of its inputs, the size and MD5
+### checksum of its outputs and the parameters it was run with. On a rerun a
+### step is skipped only if all of these still match; outputs are written
+### to a temporary name and renamed into place (see atomicPath), so a killed
+### job never leaves a truncated file that looks finished.
+#############################################################################
+
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+#############################################################################
+# Variables
+#############################################################################
+MANIFEST_VERSION=1
+# suffix of outputs being written
+PARTIAL_SUFFIX='.part'
+
+#############################################################################
+# Functions
+#############################################################################
+def describeFiles( file_list ):
+    """
+    Describes input files by absolute path, size and modification time. Returns a list of dicts in the order of file_list.
+    Usage example: describeFiles( file_list = ['/home/Undetermined/Undetermined_S0_L001_R1_001.fastq.gz'] )
+    """
+    described=[]
+    for i in file_list:
+        st=os.stat(i)
+        described.append({'path': os.path.abspath(i), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns})
+    return(described)
+
+def fileChecksum( file ):
+    """
+    Returns the MD5 checksum (hex) of a file, read in 16 MB blocks.
+    Usage example: fileChecksum( file = '/home/Undetermined_clean/Undetermined_clean_S0_L001_R1_001.fastq.gz' )
+    """
+    md5=hashlib.md5()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            md5.update(block)
+    return(md5.hexdigest())
+
+@contextmanager
+def atomicPath( path ):
+    """
+    Yields a temporary path next to path to write an output to; the temporary file is renamed to path if the block succeeds
+    and removed if it fails.
+    Usage example: with atomicPath( path = 'Undetermined_clean_S0_L001_R1_001.fastq.gz' ) as tmp: cleanUndetermined(..., out_file = tmp)
+    """
+    tmp=path+PARTIAL_SUFFIX
+    # left over by a killed run
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        yield(tmp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+#############################################################################
+# Classes
+#############################################################################
+class Manifest:
+    """
+    JSON checkpoint manifest of finished steps: {"version": 1, "steps": {key: {"inputs": [...], "outputs": [...], "params": {...}, "finished": ...}}}.
+    Updates are made under an exclusive lock on path+'.lock' and written atomically, so several processes can share a manifest.
+    With verify=True, isDone also checks the MD5 checksums of the outputs; with resume=False, no step is taken as done (all are redone and recorded again).
+    Usage example: manifest=Manifest( path = '/work/.../DEMUX/221014_JABBA113_AXXXXX/cleanUndetermined.manifest.json' )
+    """
+    def __init__( self, path, verify=False, resume=True ):
+        self.path=path
+        self.verify=verify
+        self.resume=resume
+
+    def load( self ):
+        """
+        Returns the recorded steps; a missing or unreadable manifest has none.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                manifest=json.load(f)
+        except (OSError, ValueError):
+            return({})
+        if manifest.get('version') != MANIFEST_VERSION:
+            return({})
+        return(manifest.get('steps', {}))
+
+    def isDone( self, key, inputs, outputs, params=None ):
+        """
+        Tests if step key was recorded as finished with the same inputs (paths, sizes, modification times) and params, and if its
+        outputs are still there with the recorded sizes (and MD5 checksums if the manifest was opened with verify=True).
+        """
+        if not self.resume:
+            return(False)
+        step=self.load().get(key)
+        if step is None or step.get('params') != (params or {}):
+            return(False)
+        try:
+            if step['inputs'] != describeFiles(inputs):
+                return(False)
+        except OSError:
+            return(False)
+        recorded={i['path']: i for i in step['outputs']}
+        for out in outputs:
+            entry=recorded.get(os.path.abspath(out))
+            if entry is None or not os.path.isfile(out) or os.path.getsize(out) != entry['size']:
+                return(False)
+            if self.verify and fileChecksum(out) != entry['md5']:
+                return(False)
+        return(True)
+
+    def record( self, key, inputs, outputs, params=None ):
+        """
+        Records step key as finished, with the description of its inputs, the sizes and MD5 checksums of its outputs and its params.
+        """
+        step={'inputs': describeFiles(inputs),
+              'outputs': [{'path': os.path.abspath(i), 'size': os.path.getsize(i), 'md5': fileChecksum(i)} for i in outputs],
+              'params': params or {},
+              'finished': time.strftime('%Y/%m/%d %H:%M:%S')}
+        with open(self.path+'.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            steps=self.load()
+            steps[key]=step
+            with open(self.path+'.tmp', 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'steps': steps}, f, indent=1)
+            os.replace(self.path+'.tmp', self.path)
@@ -0,0 +1,181 @@
+#############################################################################
+### Structured metrics for the DEMUX scripts.
+###
+### Phases of work are timed with phase(); each phase appends one JSON line
+### to the metrics file with its wall and CPU time, the peak RSS sampled
+### while it ran, and any counters the phase filled in (reads, kept,
+### dropped, in_bytes, out_bytes, ...), from which reads/s and bytes/s are
+### derived. Phases run with profile=True are also profiled with cProfile,
+### the statistics of every process being dumped to <profile>.<pid>.prof
+### (open with pstats or snakeviz).
+###
+### Nothing is recorded until configureMetrics is called; like
+### configureCompression, it must be called in every worker process.
+#############################################################################
+
+import cProfile
+import fcntl
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+#############################################################################
+# Variables
+#############################################################################
+# current settings, see configureMetrics
+metrics={'file': None, 'tool': None, 'profile': None, 'interval': 0.2}
+# per-process state: RSS sampler and profiler, restarted in forked processes
+state={'pid': None, 'sampler': None, 'profiler': None, 'profiling': False}
+PAGE_SIZE=os.sysconf('SC_PAGE_SIZE')
+
+#############################################################################
+# Functions
+#############################################################################
+def configureMetrics( file=None, tool=None, profile=None, interval=0.2 ):
+    """
+    Sets the JSON lines file metrics are appended to (None disables metrics), the tool name written in every record, the path
+    prefix of the cProfile dumps of profiled phases (None disables profiling) and the RSS sampling interval in seconds.
+    Must be called in every worker process (e.g. in the multiprocessing.Pool initializer) for the settings to apply there.
+    Usage example: configureMetrics( file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/cleanUndetermined.metrics.jsonl', tool = 'cleanUndetermined' )
+    """
+    metrics.update(file=file, tool=tool, profile=profile, interval=interval)
+
+def currentRss():
+    """
+    Returns the resident set size of this process in bytes (from /proc/self/statm), or its peak RSS where /proc is not available.
+    Usage example: currentRss()
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return(int(f.read().split()[1])*PAGE_SIZE)
+    except OSError:
+        return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024)
+
+def processState():
+    """
+    Returns the per-process state, reset in a process forked from the one that made it (threads and profilers do not survive fork).
+    """
+    if state['pid'] != os.getpid():
+        state.update(pid=os.getpid(), sampler=None, profiler=None, profiling=False)
+    return(state)
+
+def recordMetrics( event, **fields ):
+    """
+    Appends one JSON record {time, tool, pid, event, **fields} to the metrics file, under an exclusive lock so that processes can share it.
+    Does nothing if no metrics file is configured.
+    Usage example: recordMetrics( 'file', input = 'Undetermined_S0_L001_R1_001.fastq.gz', reads = 1000, kept = 400 )
+    """
+    if metrics['file'] is None:
+        return
+    record={'time': time.strftime('%Y/%m/%d %H:%M:%S'), 'tool': metrics['tool'], 'pid': os.getpid(), 'event': event}
+    record.update(fields)
+    with open(metrics['file'], 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(record)+'\n')
+
+@contextmanager
+def phase( name, profile=False, **fields ):
+    """
+    Times a phase of work and records it (see recordMetrics) with fields, wall and CPU seconds, the peak RSS sampled while it ran
+    and the counters the block put in the yielded dict; reads_per_s and bytes_per_s are added if it set 'reads' or 'in_bytes'.
+    With profile=True and a profile prefix configured, the phase is profiled too. Does nothing if no metrics file is configured.
+    Usage example: with phase( 'clean', input = undet_FQ ) as counters: counters['reads']=cleanUndetermined(...)[0]
+    """
+    counters={}
+    if metrics['file'] is None:
+        yield(counters)
+        return
+    sampler=rssSampler()
+    peak=sampler.watch()
+    profiler=phaseProfiler() if profile else None
+    st=time.perf_counter()
+    cpu=time.process_time()
+    try:
+        if profiler:
+            profiler.enable()
+        yield(counters)
+    finally:
+        if profiler:
+            profiler.disable()
+            processState()['profiling']=False
+            profiler.dump_stats(metrics['profile']+'.%d.prof' % os.getpid())
+        elapsed=time.perf_counter()-st
+        sampler.unwatch(peak)
+    record=dict(fields, phase=name, seconds=round(elapsed, 4), cpu_seconds=round(time.process_time()-cpu, 4),
+                peak_rss_mb=round(max(peak[0], currentRss())/(1 << 20), 1),
+                max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1))
+    record.update(counters)
+    if 'reads' in counters:
+        record['reads_per_s']=round(counters['reads']/max(elapsed, 1e-9))
+    if 'in_bytes' in counters:
+        record['bytes_per_s']=round(counters['in_bytes']/max(elapsed, 1e-9))
+    recordMetrics('phase', **record)
+
+def rssSampler():
+    """
+    Returns the RSS sampler of this process, started on first use.
+    """
+    current=processState()
+    if current['sampler'] is None:
+        current['sampler']=RssSampler(metrics['interval'])
+        current['sampler'].start()
+    return(current['sampler'])
+
+def phaseProfiler():
+    """
+    Returns the cProfile profiler of this process, made on first use; its statistics accumulate over all profiled phases.
+    Returns None if no profile prefix is configured or a profiled phase is already running.
+    """
+    if metrics['profile'] is None:
+        return(None)
+    current=processState()
+    # not re-entrant: nested profiled phases are covered by the outer one
+    if current['profiling']:
+        return(None)
+    if current['profiler'] is None:
+        current['profiler']=cProfile.Profile()
+    current['profiling']=True
+    return(current['profiler'])
+
+#############################################################################
+# Classes
+#############################################################################
+class RssSampler(threading.Thread):
+    """
+    Daemon thread sampling the RSS of this process every interval seconds, keeping the peak seen by each watched phase.
+    Usage example: sampler=RssSampler( interval = 0.2 ); sampler.start(); peak=sampler.watch(); ...; sampler.unwatch(peak); print(peak[0])
+    """
+    def __init__( self, interval=0.2 ):
+        threading.Thread.__init__(self, name='RssSampler', daemon=True)
+        self.interval=interval
+        self.watched=[]
+        self.lock=threading.Lock()
+
+    def run( self ):
+        while True:
+            time.sleep(self.interval)
+            rss=currentRss()
+            with self.lock:
+                for peak in self.watched:
+                    if rss > peak[0]:
+                        peak[0]=rss
+
+    def watch( self ):
+        """
+        Starts watching a phase. Returns its peak, a one-item list updated by the sampler.
+        """
+        peak=[currentRss()]
+        with self.lock:
+            self.watched.append(peak)
+        return(peak)
+
+    def unwatch( self, peak ):
+        """
+        Stops watching a phase.
+        """
+        with self.lock:
+            # by identity: peaks of nested phases may be equal
+            self.watched=[i for i in self.watched if i is not peak]
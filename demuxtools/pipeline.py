@@ -0,0 +1,157 @@
+#############################################################################
+### Threaded read -> filter -> write pipeline for cleaning fastq files.
+###
+### The reader thread decompresses and parses batches of records, the
+### calling thread filters them and the writer thread compresses and writes
+### the kept records. The stages are connected by queues of at most depth
+### batches, so a slow stage holds the others back instead of letting
+### batches pile up in memory. zlib, isal and zlib-ng release the GIL while
+### (de)compressing, so decompression, filtering and compression (and the
+### waits on a network filesystem) overlap.
+###
+### Every stage measures the time it spent working and waiting for its
+### input or output queue: the busiest stage is the bottleneck.
+#############################################################################
+
+import queue
+import threading
+import time
+from itertools import islice
+
+from demuxtools.log import printMsg
+from demuxtools.metrics import recordMetrics
+
+#############################################################################
+# Variables
+#############################################################################
+# current settings, see configurePipeline
+pipeline={'enabled': False, 'batch_size': 100000, 'depth': 4}
+# end of stream marker passed through the queues
+END=object()
+STAGES=('read', 'filter', 'write')
+
+#############################################################################
+# Functions
+#############################################################################
+def configurePipeline( enabled=False, batch_size=100000, depth=4 ):
+    """
+    Sets whether fastq files are cleaned by a threaded pipeline (see runPipeline), the number of records per batch and the maximum
+    number of batches waiting between two stages.
+    Must be called in every worker process (e.g. in the multiprocessing.Pool initializer) for the settings to apply there.
+    Usage example: configurePipeline( enabled = True, batch_size = 50000, depth = 8 )
+    """
+    if batch_size < 1 or depth < 1:
+        raise ValueError("The pipeline batch size and queue depth must be at least 1.")
+    pipeline.update(enabled=enabled, batch_size=batch_size, depth=depth)
+
+def batchRecords( records, batch_size ):
+    """
+    Groups an iterator of records into lists of at most batch_size records.
+    Usage example: for batch in batchRecords( records = fastqRecords(handle), batch_size = 100000 ): ...
+    """
+    while True:
+        batch=list(islice(records, batch_size))
+        if not batch:
+            return
+        yield(batch)
+
+def runPipeline( batches, transform, write, depth=4, name='' ):
+    """
+    Runs three stages at the same time: the reader thread takes the batches from the iterator batches, the calling thread applies transform
+    to every batch and the writer thread passes the results to write, in order. An exception in any stage stops the pipeline and is raised.
+    Per-stage statistics (batches, seconds working, seconds waiting for input and for room in the output queue) are reported for name,
+    recorded as a 'pipeline' metrics event (see demuxtools.metrics) and returned as a dict {stage: statistics}.
+    Usage example: runPipeline( batches = batchRecords(fastqRecords(undet_handle), 100000), transform = filterBatch, write = out_handle.write, depth = 4 )
+    """
+    read_queue=queue.Queue(maxsize=depth)
+    write_queue=queue.Queue(maxsize=depth)
+    stop=threading.Event()
+    errors=[]
+    stats={stage: {'batches': 0, 'busy_s': 0.0, 'wait_in_s': 0.0, 'wait_out_s': 0.0} for stage in STAGES}
+    st=time.perf_counter()
+    threads=[threading.Thread(target=runStage, name='pipeline-read', daemon=True, args=(iter(batches), lambda batch: batch, read_queue, stats['read'], stop, errors)),
+             threading.Thread(target=runStage, name='pipeline-write', daemon=True, args=(queueItems(write_queue, stats['write'], stop), write, None, stats['write'], stop, errors))]
+    for thread in threads:
+        thread.start()
+    runStage(queueItems(read_queue, stats['filter'], stop), transform, write_queue, stats['filter'], stop, errors)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    elapsed=time.perf_counter()-st
+    for stage in STAGES:
+        stats[stage]={i: round(j, 4) for (i, j) in stats[stage].items()}
+        stats[stage]['utilization']=round(stats[stage]['busy_s']/max(elapsed, 1e-9), 3)
+    bottleneck=max(STAGES, key=lambda i: stats[i]['busy_s'])
+    printMsg("Pipeline of "+name+": "+', '.join(i+' '+str(round(stats[i]['busy_s'], 2))+' s busy' for i in STAGES)+
+             " in "+str(round(elapsed, 2))+" s; bottleneck: "+bottleneck+".")
+    recordMetrics('pipeline', input=name, seconds=round(elapsed, 4), batch_queue_depth=depth, bottleneck=bottleneck, stages=stats)
+    return(stats)
+
+def runStage( items, work, out_queue, stats, stop, errors ):
+    """
+    Runs a pipeline stage: applies work to every item of items and puts the results in out_queue (if not None), then the end marker.
+    Time spent getting items (minus the waits on an input queue, counted by queueItems) and working is counted as busy.
+    On an exception, the error is saved in errors and stop is set, so that the other stages stop.
+    """
+    try:
+        while True:
+            t=time.perf_counter()
+            item=next(items, END)
+            if item is END:
+                stats['busy_s']+=time.perf_counter()-t
+                break
+            result=work(item)
+            stats['busy_s']+=time.perf_counter()-t
+            stats['batches']+=1
+            if out_queue is not None:
+                putItem(out_queue, result, stats, stop)
+        if out_queue is not None:
+            putItem(out_queue, END, stats, stop)
+    except PipelineStopped:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    # waits on the input queue were counted as busy by the loop above
+    stats['busy_s']-=stats['wait_in_s']
+
+def queueItems( in_queue, stats, stop ):
+    """
+    Yields the items of in_queue until the end marker, counting the time waited in stats['wait_in_s'].
+    """
+    while True:
+        t=time.perf_counter()
+        while True:
+            try:
+                item=in_queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if stop.is_set():
+                    raise PipelineStopped()
+        stats['wait_in_s']+=time.perf_counter()-t
+        if item is END:
+            return
+        yield(item)
+
+def putItem( out_queue, item, stats, stop ):
+    """
+    Puts item in out_queue, waiting for room (back-pressure) and counting the time waited in stats['wait_out_s'].
+    """
+    t=time.perf_counter()
+    while True:
+        try:
+            out_queue.put(item, timeout=0.1)
+            break
+        except queue.Full:
+            if stop.is_set():
+                raise PipelineStopped()
+    stats['wait_out_s']+=time.perf_counter()-t
+
+#############################################################################
+# Classes
+#############################################################################
+class PipelineStopped(Exception):
+    """
+    Raised in a pipeline stage when another stage failed.
+    """
@@ -0,0 +1,169 @@
+#############################################################################
+### Header-only FASTQ scanner: extracts the read coordinates (lane, tile,
+### x, y) of every read straight from the decompressed bytes.
+###
+### The file is read in large binary chunks; only every 4th line (the
+### header) is looked at and its coordinate fields are parsed into integers
+### with vectorized NumPy operations, without building per-read strings or
+### (title, seq, qual) tuples.
+#############################################################################
+
+import numpy as np
+from demuxtools.fastqio import openFastq
+from demuxtools.layout import extractReadCoordinates
+
+#############################################################################
+# Variables
+#############################################################################
+# bytes read from the decompressed stream per chunk
+CHUNK_SIZE=1 << 24
+NEWLINE=ord('\n')
+COLON=ord(':')
+SPACE=ord(' ')
+# whitespace ending the read name of a header, as str.split(None) does: space, or tab to carriage return
+TAB=ord('\t')
+CARRIAGE_RETURN=ord('\r')
+
+#############################################################################
+# Functions
+#############################################################################
+def scanReadCoordinates( file, chunk_size=CHUNK_SIZE, names=False ):
+    """
+    Scans a FASTQ.GZ file and yields, per chunk of reads, a tuple of NumPy int64 arrays (lane, tile, x, y) in file order; with names=True,
+    followed by the list of the read coordinates as written in the headers (lane:tile:x:y and any fields after y, e.g. a UMI, see extractReadCoordinates).
+    Raises ValueError if a header does not hold Illumina read coordinates (@instrument:run:flowcell:lane:tile:x:y).
+    Usage example: for (lane, tile, x, y) in scanReadCoordinates( file = '/home/Proj_1/S1_L001_R1_001.fastq.gz' ): ...
+    """
+    with openFastq(file, 'rb') as fq:
+        tail=b''
+        # position within a 4-line record of the first line of the next chunk (0 = header)
+        phase=0
+        while True:
+            chunk=fq.read(chunk_size)
+            if not chunk:
+                break
+            buf=tail+chunk if tail else chunk
+            cut=buf.rfind(b'\n')+1
+            tail=buf[cut:]
+            if cut == 0:
+                continue
+            (coords, phase)=scanLines(np.frombuffer(buf, dtype=np.uint8, count=cut), phase, file, names)
+            yield(coords)
+        if tail.strip():
+            (coords, phase)=scanLines(np.frombuffer(tail+b'\n', dtype=np.uint8), phase, file, names)
+            yield(coords)
+
+def scanLines( buf, phase, file, names=False ):
+    """
+    Parses the coordinates of the header lines of a buffer of complete FASTQ lines whose first line is at position phase of a record.
+    Returns ((lane, tile, x, y), phase of the line following the buffer), with the read coordinate names after y if names=True (see parseHeaderCoordinates).
+    Usage example: scanLines( buf = np.frombuffer(b'@A:1:FC:1:1101:1000:2000 1:N:0:ACGT\\nACGT\\n+\\nFFFF\\n', dtype=np.uint8), phase = 0, file = 'my.fastq' )
+    """
+    ends=np.flatnonzero(buf == NEWLINE)
+    first=(4-phase) % 4
+    header_ends=ends[first::4]
+    header_starts=np.empty(len(header_ends), dtype=np.int64)
+    if len(header_ends):
+        # a header starts right after the newline ending the previous line (or at the buffer start)
+        prev=np.arange(first, len(ends), 4)-1
+        header_starts[:]=np.where(prev >= 0, ends[np.maximum(prev, 0)]+1, 0)
+    return(parseHeaderCoordinates(buf, header_starts, header_ends, file, names), (phase+len(ends)) % 4)
+
+def parseHeaderCoordinates( buf, starts, ends, file, names=False ):
+    """
+    Parses the lane, tile, x and y fields of the header lines buf[starts:ends] (@instrument:run:flowcell:lane:tile:x:y[:UMI] [comment]).
+    The header bytes are gathered into one matrix (a row per header), so that only header bytes are searched for delimiters.
+    Returns a tuple of NumPy int64 arrays (lane, tile, x, y), followed with names=True by the list of the read coordinate strings
+    lane:tile:x:y[:UMI] of the headers (the read name from its 4th field on, see extractReadCoordinates).
+    Usage example: parseHeaderCoordinates( buf = buf, starts = np.array([0]), ends = np.array([35]), file = 'my.fastq' )
+    """
+    n=len(starts)
+    if n == 0:
+        empty=np.zeros(0, dtype=np.int64)
+        return((empty, empty, empty, empty)+(([],) if names else ()))
+    width=int((ends-starts).max())+1
+    columns=np.arange(width)
+    # gather the headers as rows of width bytes, padded with spaces after the end of line; the first whitespace ends the read name
+    padded=np.concatenate((buf, np.full(width, SPACE, dtype=np.uint8)))
+    headers=np.lib.stride_tricks.sliding_window_view(padded, width)[starts]
+    headers[columns >= (ends-starts)[:, None]]=SPACE
+    token_ends=np.argmax((headers == SPACE) | ((headers >= TAB) & (headers <= CARRIAGE_RETURN)), axis=1)
+    (rows, cols)=np.nonzero((headers == COLON) & (columns < token_ends[:, None]))
+    counts=np.bincount(rows, minlength=n)
+    if np.any(counts < 6):
+        bad=int(np.argmax(counts < 6))
+        raise ValueError("Read header '"+bytes(buf[starts[bad]:ends[bad]]).decode(errors='replace')+"' in "+file+" has no lane:tile:x:y read coordinates.")
+    # columns of the 3rd to 6th colons of every header, then the end of the y field (7th colon or end of the read name)
+    first=np.cumsum(counts)-counts
+    c=[cols[first+k] for k in range(2, 6)]
+    y_end=np.where(counts > 6, cols[np.minimum(first+6, len(cols)-1)], token_ends)
+    offset=np.arange(n)*width
+    flat=headers.ravel()
+    lane=parseDigits(flat, offset+c[0]+1, offset+c[1], file)
+    tile=parseDigits(flat, offset+c[1]+1, offset+c[2], file)
+    x=parseDigits(flat, offset+c[2]+1, offset+c[3], file)
+    y=parseDigits(flat, offset+c[3]+1, offset+y_end, file)
+    if not names:
+        return((lane, tile, x, y))
+    # the bytes after the 3rd colon up to the end of the read name, each followed by a newline, joined row by row
+    headers[np.arange(n), token_ends]=NEWLINE
+    keep=(columns > c[0][:, None]) & (columns <= token_ends[:, None])
+    return((lane, tile, x, y, headers[keep].tobytes().decode().split('\n')[:-1]))
+
+def parseTitleCoordinates( titles ):
+    """
+    Parses the lane, tile, x and y read coordinates of a batch of fastq titles (read headers without '@', as yielded by fastqRecords)
+    all at once with parseHeaderCoordinates. If the batch cannot be parsed that way, the titles are parsed one by one in Python instead
+    (see demuxtools.layout.extractReadCoordinates), which raises ValueError for a title without read coordinates.
+    Returns a tuple of NumPy int64 arrays (lane, tile, x, y).
+    Usage example: parseTitleCoordinates( titles = ['A00123:8:HABABA:1:1101:15589:1331 1:N:0:ACGTACGT'] )
+    """
+    buf=np.frombuffer(('\n'.join(titles)+'\n').encode(), dtype=np.uint8)
+    ends=np.flatnonzero(buf == NEWLINE)
+    if len(ends) == len(titles):
+        try:
+            return(parseHeaderCoordinates(buf, np.concatenate(([0], ends[:-1]+1)), ends, 'the batch'))
+        except ValueError:
+            pass
+    # pure-Python fallback, one title at a time
+    coords=[]
+    for title in titles:
+        lane, tile, x, y = (int(i) for i in extractReadCoordinates(title).split(sep=':')[:4])
+        coords.append((lane, tile, x, y))
+    return(tuple(np.array(i, dtype=np.int64) for i in zip(*coords)) if coords else tuple(np.zeros(0, dtype=np.int64) for _ in range(4)))
+
+def parseCoordinateLines( text ):
+    """
+    Parses read coordinate lines 'lane:tile:x:y' (as written to the read coordinates file) all at once.
+    Returns a tuple of NumPy int64 arrays (lane, tile, x, y). Raises ValueError if a line does not have exactly these four numbers.
+    Usage example: parseCoordinateLines( text = '1:1101:15589:1331\n1:1101:15600:1340\n' )
+    """
+    buf=np.frombuffer(text.encode(), dtype=np.uint8)
+    if len(buf) and buf[-1] != NEWLINE:
+        buf=np.append(buf, np.uint8(NEWLINE))
+    ends=np.flatnonzero(buf == NEWLINE)
+    colons=np.flatnonzero(buf == COLON)
+    if len(colons) != 3*len(ends) or np.any(np.searchsorted(ends, colons) != np.repeat(np.arange(len(ends)), 3)):
+        raise ValueError("Read coordinate lines must be lane:tile:x:y.")
+    colons=colons.reshape(-1, 3)
+    starts=np.concatenate(([0], ends[:-1]+1)).astype(np.int64)
+    return((parseDigits(buf, starts, colons[:, 0], 'the read coordinates'), parseDigits(buf, colons[:, 0]+1, colons[:, 1], 'the read coordinates'),
+            parseDigits(buf, colons[:, 1]+1, colons[:, 2], 'the read coordinates'), parseDigits(buf, colons[:, 2]+1, ends, 'the read coordinates')))
+
+def parseDigits( buf, begin, end, file ):
+    """
+    Parses the decimal fields buf[begin:end] into a NumPy int64 array, one digit position at a time for all fields at once.
+    Raises ValueError if a field is empty or not a number.
+    Usage example: parseDigits( buf = np.frombuffer(b'1101:2000', dtype=np.uint8), begin = np.array([0, 5]), end = np.array([4, 9]), file = 'my.fastq' )
+    """
+    length=end-begin
+    if len(length) and (length.min() <= 0 or length.max() > 18):
+        raise ValueError("Empty or oversized read coordinate field in "+file+".")
+    values=np.zeros(len(begin), dtype=np.int64)
+    for k in range(int(length.max()) if len(length) else 0):
+        inside=k < length
+        digits=buf[np.where(inside, begin+k, 0)].astype(np.int64)-ord('0')
+        if np.any(inside & ((digits < 0) | (digits > 9))):
+            raise ValueError("Non-numeric read coordinate field in "+file+".")
+        values=np.where(inside, values*10+digits, values)
+    return(values)
@@ -0,0 +1,402 @@
+#############################################################################
+### Read coordinates per tile of a DEMUX run (command: tiles).
+###
+### Extracts the read coordinates of the R1 fastqs of all Unaligned projects
+### and writes them to one file per tile (lane_tile) in perTileReadsTMP,
+### and/or to one memory-mapped tile store (see demuxtools.tilestore).
+#############################################################################
+
+import os
+import shutil
+import sys
+from collections import OrderedDict
+from contextlib import ExitStack
+
+import numpy as np
+
+from demuxtools.layout import loadRunLayout, extractTile
+from demuxtools.log import printMsg
+from demuxtools.manifest import Manifest, atomicPath, PARTIAL_SUFFIX
+from demuxtools.metrics import phase
+from demuxtools.scanner import scanReadCoordinates, parseCoordinateLines
+from demuxtools.tilestore import TileStoreWriter, STORE_NAME
+
+#############################################################################
+# Variables
+#############################################################################
+# dev: define separator
+separ='/'#os.sep
+# project fastqs the read coordinates are extracted from
+READ1_PATTERN='*_R1_001.*'
+# checkpoint manifest of the read coordinates and tile files, in the DEMUX_RUN directory
+MANIFEST_NAME='sortReadsPerTile.manifest.json'
+# bytes of read coordinate lines parsed at once
+LINES_CHUNK_SIZE=1 << 24
+# outputs of the tiles command: text tile files, the tile store, or both
+TILE_FORMATS=('text', 'store', 'both')
+
+#############################################################################
+# Functions
+#############################################################################
+def processUnalFqXtractReadCoords( file_list , read_coord_file ):
+    """
+    Process list of fastq files to extract read coordinates (header-only scan, see demuxtools.scanner) and write to file, as they are
+    written in the read headers (lane:tile:x:y and any fields after y, e.g. a UMI).
+    Returns a tuple with the set of tiles ('lane_tile') seen and the number of reads.
+    Usage example: processUnalFqXtractReadCoords( file_list = ['/home/myPath1/myFile_R1_001.fastq.gz', '/home/myPath1/myFile_R2_001.fastq.gz'] ,
+    read_coord_file = "/path/to/read_coordinates_file.txt" )
+    """
+    tiles_set=set()
+    n_reads=0
+    for fq in file_list:
+        print(fq)
+        with open(read_coord_file, "a+") as headers_file:
+            for (lane, tile, x, y, names) in scanReadCoordinates(fq, names=True):
+                n_reads+=len(lane)
+                tiles_set.update('%d_%d' % (i >> 32, i & 0xffffffff) for i in np.unique((lane << 32) | tile).tolist())
+                headers_file.write(''.join(i+'\n' for i in names))
+    printMsg("Read coordiantes file ready: "+'\n'+read_coord_file)
+    return(tiles_set, n_reads)
+
+def makeReadCoorFile( conf_file , tmp_directory_name, manifest=None ):
+    """
+    Makes the combined read coordinates file readsCoordiates.txt of the *_R1_001.* files of all Unaligned projects in the tmp_directory_name folder.
+    The file is written to a temporary name and renamed when complete. With a checkpoint manifest (see demuxtools.manifest), it is recorded
+    with its input fastqs and kept if recorded with the same, unchanged inputs; without one, a file already present is kept.
+    Returns a tuple with the set of tiles ('lane_tile') and the path of the file.
+    Usage example: makeReadCoorFile( conf_file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf', tmp_directory_name = 'perTileReadsTMP' )
+    """
+    # set 
+    layout=loadRunLayout(conf_file)
+    tmp_dir=layout.runFile(tmp_directory_name)
+
+    # define file name
+    read_coord_file=tmp_dir+separ+'readsCoordiates.txt'
+    #make temporary folder for read_coordinates per tile
+    if not os.path.isdir(tmp_dir):
+        os.mkdir(tmp_dir)
+        printMsg("Temporary directory for read coordinates per tile created.")
+    else:
+        printMsg("Temporary directory for read coordinates per tile already exists.")
+
+    fq_list=layout.read1Files(READ1_PATTERN)
+    if not (manifest.isDone(os.path.abspath(read_coord_file), fq_list, [read_coord_file]) if manifest is not None else os.path.exists(read_coord_file)):
+        printMsg("Extracting read coordinates from file "+read_coord_file)
+        with phase('readCoordinates', profile=True, output=read_coord_file) as counters:
+            with atomicPath(read_coord_file) as tmp_file:
+                (tiles, n_reads)=processUnalFqXtractReadCoords(read_coord_file=tmp_file, file_list=fq_list)
+            counters.update(reads=n_reads, tiles=len(tiles), in_bytes=sum(os.path.getsize(i) for i in fq_list), out_bytes=os.path.getsize(read_coord_file))
+        if manifest is not None:
+            manifest.record(os.path.abspath(read_coord_file), fq_list, [read_coord_file])
+        return( tiles, read_coord_file )
+    else:
+        printMsg("File "+read_coord_file+" already exists.")
+        tiles=set()
+        with open(read_coord_file, "r") as rcf:
+            for lines in iter(lambda: rcf.readlines(LINES_CHUNK_SIZE), []):
+                tiles.update(coordinateLinesTiles(lines))
+        return(tiles, read_coord_file)
+    
+
+def sortReadCoorsPerTile( conf_file, max_open_files=256, tile_buffer_size=1<<20, stream=False, keep_combined=False, sort_tiles=False, tile_format='text', resume=True, verify=False ):
+    """
+    Splits the read coordinates of the run into one file per tile in the perTileReadsTMP folder.
+    Tile files are written through a TileWriterPool: buffered per tile, with at most max_open_files files open at once.
+    By default the combined read coordinates file is made first (see makeReadCoorFile) and split per tile. With stream=True, the coordinates
+    extracted from the *_R1_001.* files go straight to the tile files, and the combined file is written only if keep_combined=True.
+    With sort_tiles=True, the read coordinates of every tile file are finally sorted by x, then y.
+    With tile_format='store' or 'both', the read coordinates are also written to the tile store STORE_NAME (see demuxtools.tilestore.TileStore)
+    straight from their arrays, by external sorting (see TileStoreWriter); with 'store', no tile file is written.
+    Tile files are written to the tiles.part folder and moved into place when all are complete; finished steps are recorded in the checkpoint
+    manifest MANIFEST_NAME next to the conf_file and, with resume=True, are not redone if their input fastqs and outputs are unchanged (their MD5
+    checksums are checked too if verify=True).
+    If metrics are configured (see demuxtools.metrics), every step and the whole run are recorded.
+    Usage example: sortReadCoorsPerTile( conf_file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf', max_open_files = 256, stream = True )
+    """
+    # set variables
+    layout=loadRunLayout(conf_file)
+    tmp_directory_name='perTileReadsTMP'
+    tmp_dir=layout.runFile(tmp_directory_name)
+    manifest=Manifest(layout.runFile(MANIFEST_NAME), verify=verify, resume=resume)
+
+    if tile_format not in TILE_FORMATS:
+        sys.exit("[FATAL] Unknown tile format "+str(tile_format)+", expected one of "+', '.join(TILE_FORMATS)+".")
+
+    with phase('run', config_file=conf_file, stream=stream, sort_tiles=sort_tiles, tile_format=tile_format):
+        # skip if the tile files are done
+        step=os.path.abspath(tmp_dir)
+        params={'sort_tiles': sort_tiles, 'tile_format': tile_format}
+        fq_list=layout.read1Files(READ1_PATTERN)
+        recorded=manifest.load().get(step)
+        if recorded and manifest.isDone(step, fq_list, [i['path'] for i in recorded['outputs']], params):
+            printMsg("Tile files in "+tmp_dir+" already present and up to date with the Unaligned fastqs.")
+            return
+
+        text=tile_format != 'store'
+        store_file=tmp_dir+separ+STORE_NAME if tile_format != 'text' else None
+        if stream:
+            (tiles, part_dir)=streamReadCoorsPerTile(conf_file, tmp_directory_name, max_open_files, tile_buffer_size, keep_combined, manifest, text, store_file)
+        else:
+            # initialize files
+            (tiles, read_coord_file)=makeReadCoorFile(conf_file, tmp_directory_name, manifest)
+            part_dir=makePartDir(tmp_dir)
+            # 
+            # crete tile files
+            with phase('tiles', profile=True, stream=False) as counters, ExitStack() as stack:
+                n_reads=0
+                # one set for all chunks: tiles missing from it are created (emptied) once and added to it
+                tiles=set(tiles) if text else set()
+                tile_files=stack.enter_context(TileWriterPool(part_dir, max_open_files=max_open_files, buffer_size=tile_buffer_size)) if text else None
+                store=openTileStore(stack, store_file) if store_file else None
+                for i in tiles:
+                    tile_files.create(i)
+                with open(read_coord_file, "r") as rcf:
+                    for lines in iter(lambda: rcf.readlines(LINES_CHUNK_SIZE), []):
+                        if text:
+                            splitCoordinateLines(lines, tile_files, tiles)
+                        if store is not None:
+                            store.add(*coordinateLinesArrays(lines))
+                        n_reads+=len(lines)
+                counters.update(reads=n_reads, tiles=len(tiles), in_bytes=os.path.getsize(read_coord_file))
+        if text:
+            printMsg("Read coordinates sorted into "+str(len(tiles))+" tile files in "+part_dir)
+        if sort_tiles and text:
+            with phase('sortTiles', tiles=len(tiles)):
+                for i in sorted(tiles):
+                    sortTileFile(part_dir+separ+i)
+            printMsg("Read coordinates of every tile file sorted by x and y.")
+        outputs=[]
+        if store_file:
+            outputs.append(store_file)
+            printMsg("Read coordinates written to the tile store "+store_file)
+        if text:
+            # move the complete tile files into place
+            for i in tiles:
+                os.replace(part_dir+separ+i, tmp_dir+separ+i)
+            outputs+=[tmp_dir+separ+i for i in sorted(tiles)]
+            printMsg("Tile files moved to "+tmp_dir)
+        os.rmdir(part_dir)
+        manifest.record(step, fq_list, outputs, params)
+
+def makePartDir( tmp_dir ):
+    """
+    Makes the empty folder tiles.part in tmp_dir, where tile files are written until they are all complete, removing the one left by a killed run.
+    Returns its path.
+    Usage example: makePartDir( tmp_dir = '/work/.../DEMUX/221014_JABBA113_AXXXXX/perTileReadsTMP' )
+    """
+    part_dir=tmp_dir+separ+'tiles'+PARTIAL_SUFFIX
+    if os.path.isdir(part_dir):
+        shutil.rmtree(part_dir)
+    os.mkdir(part_dir)
+    return(part_dir)
+
+def streamReadCoorsPerTile( conf_file, tmp_directory_name, max_open_files=256, tile_buffer_size=1<<20, keep_combined=False, manifest=None, text=True, store_file=None ):
+    """
+    Extracts the read coordinates of the *_R1_001.* files of all Unaligned projects (header-only scan, see demuxtools.scanner) and writes
+    them straight to one file per tile in the tiles.part folder (see makePartDir) if text=True, and to the tile store store_file if given
+    (see openTileStore); the combined read coordinates file is written too (renamed into place when complete, and recorded in manifest if given) if keep_combined=True.
+    Returns a tuple with the set of tiles ('lane_tile') seen and the path of the tiles.part folder.
+    Usage example: streamReadCoorsPerTile( conf_file = '/work/.../DEMUX/221014_JABBA113_AXXXXX/master_demux.conf', tmp_directory_name = 'perTileReadsTMP' )
+    """
+    layout=loadRunLayout(conf_file)
+    tmp_dir=layout.runFile(tmp_directory_name)
+    read_coord_file=tmp_dir+separ+'readsCoordiates.txt'
+    if not os.path.isdir(tmp_dir):
+        os.mkdir(tmp_dir)
+        printMsg("Temporary directory for read coordinates per tile created.")
+    else:
+        printMsg("Temporary directory for read coordinates per tile already exists.")
+
+    part_dir=makePartDir(tmp_dir)
+    fq_list=layout.read1Files(READ1_PATTERN)
+    printMsg("Streaming read coordinates to tile files in "+part_dir)
+    tiles_set=set()
+    with phase('tiles', profile=True, stream=True) as counters, ExitStack() as stack:
+        combined=stack.enter_context(open(stack.enter_context(atomicPath(read_coord_file)), "w")) if keep_combined else None
+        tile_files=stack.enter_context(TileWriterPool(part_dir, max_open_files=max_open_files, buffer_size=tile_buffer_size)) if text else None
+        store=openTileStore(stack, store_file) if store_file else None
+        n_reads=0
+        for fq in fq_list:
+            print(fq)
+            for (lane, tile, x, y, names) in scanReadCoordinates(fq, names=True):
+                lines=[i+'\n' for i in names] if text or combined else None
+                if text:
+                    writeCoordsPerTile(lane, tile, lines, tile_files, tiles_set)
+                if store is not None:
+                    store.add(lane, tile, x, y)
+                n_reads+=len(lane)
+                if combined:
+                    combined.write(''.join(lines))
+        counters.update(reads=n_reads, tiles=len(tiles_set), in_bytes=sum(os.path.getsize(i) for i in fq_list))
+    if combined:
+        if manifest is not None:
+            manifest.record(os.path.abspath(read_coord_file), fq_list, [read_coord_file])
+        printMsg("Read coordiantes file ready: "+'\n'+read_coord_file)
+    return(tiles_set, part_dir)
+
+def openTileStore( stack, store_file ):
+    """
+    Opens a TileStoreWriter on a temporary file in stack (an ExitStack): the tile store is written when stack exits and renamed to store_file
+    (see atomicPath), or removed on an error. Returns the TileStoreWriter.
+    Usage example: with ExitStack() as stack: store=openTileStore( stack = stack, store_file = 'perTileReadsTMP/readCoordinates.tilestore' )
+    """
+    return(stack.enter_context(TileStoreWriter(stack.enter_context(atomicPath(store_file)))))
+
+def writeCoordsPerTile( lane, tile, lines, tile_files, tiles_set ):
+    """
+    Writes read coordinate lines to the file of their tile ('lane_tile', from the lane and tile arrays of the lines) in tile_files,
+    keeping the file order within a tile. The file of a tile not yet in tiles_set is created (emptied) first and the tile is added to tiles_set.
+    Usage example: writeCoordsPerTile( lane = np.array([1]), tile = np.array([1101]), lines = ['1:1101:1000:2000\n'], tile_files = tile_files, tiles_set = set() )
+    """
+    key=(lane << 32) | tile
+    order=np.argsort(key, kind='stable')
+    for idx in np.split(order, np.flatnonzero(np.diff(key[order]))+1):
+        if len(idx) == 0:
+            continue
+        tt='%d_%d' % (lane[idx[0]], tile[idx[0]])
+        if tt not in tiles_set:
+            tiles_set.add(tt)
+            tile_files.create(tt)
+        tile_files.write(tt, ''.join(lines[i] for i in idx.tolist()))
+
+def splitCoordinateLines( lines, tile_files, tiles_set ):
+    """
+    Writes a chunk of read coordinate lines to the files of their tiles in tile_files, keeping the file order within a tile. The chunk is
+    parsed at once (see parseCoordinateLines) and split with writeCoordsPerTile; lines in another format are split one by one (see extractTile).
+    Returns the number of lines.
+    Usage example: splitCoordinateLines( lines = ['1:1101:1000:2000\n'], tile_files = tile_files, tiles_set = {'1_1101'} )
+    """
+    try:
+        (lane, tile, x, y)=parseCoordinateLines(''.join(lines))
+    except ValueError:
+        for line in lines:
+            tile_files.write(extractTile(line.strip()), line)
+        return(len(lines))
+    writeCoordsPerTile(lane, tile, lines, tile_files, tiles_set)
+    return(len(lines))
+
+def coordinateLinesArrays( lines ):
+    """
+    Returns the lane, tile, x and y read coordinates of a chunk of read coordinate lines as NumPy int64 arrays, parsed at once (see
+    parseCoordinateLines) or, for lines with more fields (e.g. UMI), one by one.
+    Usage example: coordinateLinesArrays( lines = ['1:1101:1000:2000\n'] )
+    """
+    try:
+        return(parseCoordinateLines(''.join(lines)))
+    except ValueError:
+        fields=[[int(j) for j in i.split(sep=':')[:4]] for i in lines if i.strip()]
+        return(tuple(np.array([i[n] for i in fields], dtype=np.int64) for n in range(4)))
+
+def coordinateLinesTiles( lines ):
+    """
+    Returns the set of tiles ('lane_tile') of a chunk of read coordinate lines, parsed at once (see parseCoordinateLines) or, for lines
+    in another format, one by one (see extractTile).
+    Usage example: coordinateLinesTiles( lines = ['1:1101:1000:2000\n'] )
+    """
+    try:
+        (lane, tile, x, y)=parseCoordinateLines(''.join(lines))
+    except ValueError:
+        return(set(extractTile(i) for i in lines))
+    return(set('%d_%d' % (i >> 32, i & 0xffffffff) for i in np.unique((lane << 32) | tile).tolist()))
+
+def sortTileFile( file ):
+    """
+    Sorts the read coordinates (lane:tile:x:y lines) of a tile file by x, then y, in place.
+    Usage example: sortTileFile( file = '/work/.../perTileReadsTMP/1_1101' )
+    """
+    with open(file, "r") as f:
+        lines=f.read().splitlines(keepends=True)
+    if not lines:
+        return
+    coords=np.array([i.split(":", 4)[2:4] for i in lines], dtype=np.int64)
+    order=np.lexsort((coords[:, 1], coords[:, 0]))
+    with open(file+".tmp", "w") as f:
+        f.write(''.join(lines[i] for i in order.tolist()))
+    os.replace(file+".tmp", file)
+
+#############################################################################
+# Classes
+#############################################################################
+class TileWriterPool:
+    """
+    Writes text to one file per tile in directory. Text is buffered per tile and written in blocks of about buffer_size bytes
+    (all buffers are flushed when together they exceed max_buffered bytes). At most max_open_files files are open at once:
+    the least recently used file is closed when another one must be opened, and reopened in append mode when needed again.
+    With binary=True, bytes are written instead of text.
+    Usage example: with TileWriterPool( directory = '/work/.../perTileReadsTMP', max_open_files = 256 ) as tile_files: tile_files.write('1_1101', '1:1101:1000:2000\n')
+    """
+    def __init__( self, directory, max_open_files=256, buffer_size=1<<20, max_buffered=1<<28, binary=False ):
+        if max_open_files < 1:
+            sys.exit("[FATAL] The maximum number of open tile files must be at least 1.")
+        self.directory=directory
+        self.max_open_files=max_open_files
+        self.buffer_size=buffer_size
+        self.max_buffered=max_buffered
+        self.binary=binary
+        self.buffers={}
+        self.sizes={}
+        self.buffered=0
+        self.handles=OrderedDict()
+
+    def __enter__( self ):
+        return(self)
+
+    def __exit__( self, *exc ):
+        self.close()
+
+    def create( self, tile ):
+        """
+        Creates (or empties) the file of tile.
+        """
+        open(self.directory+separ+tile, "wb" if self.binary else "w").close()
+
+    def write( self, tile, text ):
+        """
+        Buffers text for the file of tile; the buffer is written once it holds buffer_size bytes.
+        """
+        if tile in self.buffers:
+            self.buffers[tile].append(text)
+        else:
+            self.buffers[tile]=[text]
+            self.sizes[tile]=0
+        self.sizes[tile]+=len(text)
+        self.buffered+=len(text)
+        if self.sizes[tile] >= self.buffer_size:
+            self.flush(tile)
+        elif self.buffered >= self.max_buffered:
+            self.flushAll()
+
+    def flush( self, tile ):
+        """
+        Writes the buffered text of tile to its file.
+        """
+        text=(b'' if self.binary else '').join(self.buffers.pop(tile))
+        self.buffered-=self.sizes.pop(tile)
+        self.handle(tile).write(text)
+
+    def flushAll( self ):
+        """
+        Writes the buffered text of all tiles, largest buffers first.
+        """
+        for tile in sorted(self.buffers, key=self.sizes.get, reverse=True):
+            self.flush(tile)
+
+    def handle( self, tile ):
+        """
+        Returns the open file of tile, opening it in append mode (and closing the least recently used file) if needed.
+        """
+        if tile in self.handles:
+            self.handles.move_to_end(tile)
+        else:
+            if len(self.handles) >= self.max_open_files:
+                self.handles.popitem(last=False)[1].close()
+            self.handles[tile]=open(self.directory+separ+tile, "ab" if self.binary else "a")
+        return(self.handles[tile])
+
+    def close( self ):
+        """
+        Writes all buffered text and closes all files.
+        """
+        self.flushAll()
+        while self.handles:
+            self.handles.popitem()[1].close()
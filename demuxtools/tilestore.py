@@ -0,0 +1,232 @@
+#############################################################################
+### Memory-mapped per-tile read coordinate store.
+###
+### One binary file holds the read coordinates of all tiles of a run: a
+### table of tiles (lane, tile, offset, count) and the x, y coordinates of
+### all reads, sorted by tile, then x and y, as one array of (x, y) uint32
+### records. TileStore memory-maps it, so the reads per tile, the
+### coordinates of a tile or an x/y range of a tile are read without
+### parsing any text.
+###
+### TileStoreWriter builds it straight from the read coordinate arrays of
+### the scanner, by external sorting: packed coordinates are sorted in runs
+### of bounded size, spilled, and merged into the store.
+###
+### Usage example:
+###   store=TileStore('/work/.../DEMUX/221014_JABBA113_AXXXXX/perTileReadsTMP/readCoordinates.tilestore')
+###   store.counts()['1_1101'], store.coordinates('1_1101')['x'], store.query('1_1101', x_range=(0, 5000))
+#############################################################################
+
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from demuxtools.coordindex import packCoordinateArrays, spillSortedRun, mergeSortedRuns, TILE_BITS, X_BITS, Y_BITS
+
+#############################################################################
+# Variables
+#############################################################################
+# tile store file: magic, header length, JSON header, tile table, (x, y) records; all little-endian
+STORE_MAGIC=b'KBTILE01'
+STORE_VERSION=1
+STORE_NAME='readCoordinates.tilestore'
+TILE_TABLE_DTYPE=np.dtype([('lane', '<u4'), ('tile', '<u4'), ('offset', '<u8'), ('count', '<u8')])
+COORD_DTYPE=np.dtype([('x', '<u4'), ('y', '<u4')])
+# packed read coordinates sorted in memory at once (8 bytes each) by TileStoreWriter
+STORE_RUN_READS=1 << 25
+
+#############################################################################
+# Functions
+#############################################################################
+def readTileStoreHeader( store_file ):
+    """
+    Reads the header of a tile store. Returns a tuple (header dict, offset of the tile table), or None if the file does not exist or is not a valid tile store.
+    Usage example: readTileStoreHeader( store_file = 'perTileReadsTMP/readCoordinates.tilestore' )
+    """
+    try:
+        with open(store_file, 'rb') as f:
+            if f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+                return(None)
+            header_length=int.from_bytes(f.read(8), 'little')
+            header=json.loads(f.read(header_length))
+    except (OSError, ValueError):
+        return(None)
+    offset=len(STORE_MAGIC)+8+header_length
+    if header.get('version') != STORE_VERSION or os.path.getsize(store_file) != offset+TILE_TABLE_DTYPE.itemsize*header['tiles']+COORD_DTYPE.itemsize*header['count']:
+        return(None)
+    return(header, offset)
+
+def rangeMask( values, value_range ):
+    """
+    Returns a boolean array, True where value_range[0] <= values < value_range[1], an end being None for no bound.
+    Usage example: rangeMask( values = np.array([1, 5, 9], dtype=np.uint32), value_range = (None, 6) )
+    """
+    mask=np.ones(len(values), dtype=bool)
+    if value_range[0] is not None:
+        mask&=values >= value_range[0]
+    if value_range[1] is not None:
+        mask&=values < value_range[1]
+    return(mask)
+
+#############################################################################
+# Classes
+#############################################################################
+class TileStore:
+    """
+    Read-only, memory-mapped view of a tile store (see TileStoreWriter). The coordinates of a tile are returned as a zero-copy slice of
+    the (x, y) records of the store; the reads per tile come from the tile table without touching the coordinates.
+    Usage example: store=TileStore( store_file = '/work/.../perTileReadsTMP/readCoordinates.tilestore' ); store.counts()
+    """
+    def __init__( self, store_file ):
+        header_offset=readTileStoreHeader(store_file)
+        if header_offset is None:
+            sys.exit("[FATAL] File "+store_file+" is not a valid tile store.")
+        (self.header, offset)=header_offset
+        self.store_file=store_file
+        self.sorted=self.header['sorted']
+        if self.header['tiles']:
+            self.table=np.memmap(store_file, dtype=TILE_TABLE_DTYPE, mode='r', offset=offset, shape=(self.header['tiles'],))
+        else:
+            self.table=np.zeros(0, dtype=TILE_TABLE_DTYPE)
+        offset+=TILE_TABLE_DTYPE.itemsize*self.header['tiles']
+        if self.header['count']:
+            self.coords=np.memmap(store_file, dtype=COORD_DTYPE, mode='r', offset=offset, shape=(self.header['count'],))
+        else:
+            self.coords=np.zeros(0, dtype=COORD_DTYPE)
+        self.positions={'%d_%d' % (lane, tile): n for (n, (lane, tile)) in enumerate(zip(self.table['lane'].tolist(), self.table['tile'].tolist()))}
+
+    def __len__( self ):
+        return(self.header['count'])
+
+    def tiles( self ):
+        """
+        Returns the tile names ('lane_tile') of the store, in lane, tile order.
+        """
+        return(list(self.positions))
+
+    def counts( self ):
+        """
+        Returns the number of reads per tile as a dict {tile name: reads}.
+        """
+        return(dict(zip(self.positions, self.table['count'].tolist())))
+
+    def coordinates( self, tile ):
+        """
+        Returns the (x, y) records of the reads of tile (fields 'x' and 'y'), a zero-copy slice of the memory-mapped store; empty for an unknown tile.
+        """
+        if tile not in self.positions:
+            return(self.coords[:0])
+        row=self.table[self.positions[tile]]
+        return(self.coords[int(row['offset']):int(row['offset'])+int(row['count'])])
+
+    def query( self, tile, x_range=None, y_range=None ):
+        """
+        Returns the (x, y) records of the reads of tile with x_range[0] <= x < x_range[1] and y_range[0] <= y < y_range[1]: a range or any of
+        its ends may be None for no bound. In a store of sorted tiles (x, then y), the x range is found by binary search and returned as a
+        zero-copy slice if there is no y range.
+        """
+        coords=self.coordinates(tile)
+        if x_range is not None and self.sorted:
+            start=np.searchsorted(coords['x'], x_range[0], side='left') if x_range[0] is not None else 0
+            stop=np.searchsorted(coords['x'], x_range[1], side='left') if x_range[1] is not None else len(coords)
+            coords=coords[start:stop]
+        elif x_range is not None:
+            coords=coords[rangeMask(coords['x'], x_range)]
+        if y_range is not None:
+            coords=coords[rangeMask(coords['y'], y_range)]
+        return(coords)
+
+class TileStoreWriter:
+    """
+    Writes the tile store store_file from arrays of read coordinates (see add), without holding them all in memory: the packed coordinates
+    (see packCoordinateArrays) are sorted in runs of at most run_reads, spilled to the folder store_file.runs, and merged into the store by close.
+    The reads of a tile are stored sorted by x, then y. Used as a context manager, the store is written on exit and the runs are removed on an error.
+    Usage example: with TileStoreWriter( store_file = 'perTileReadsTMP/readCoordinates.tilestore' ) as store: store.add(lane, tile, x, y)
+    """
+    def __init__( self, store_file, run_reads=STORE_RUN_READS ):
+        self.store_file=store_file
+        self.run_dir=store_file+'.runs'
+        # left over by a killed run
+        if os.path.isdir(self.run_dir):
+            shutil.rmtree(self.run_dir)
+        os.mkdir(self.run_dir)
+        self.run=np.empty(run_reads, dtype=np.uint64)
+        self.size=0
+        self.run_files=[]
+        self.tiles=set()
+        self.count=0
+
+    def __enter__( self ):
+        return(self)
+
+    def __exit__( self, exc_type, *exc ):
+        if exc_type is None:
+            self.close()
+        else:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+
+    def add( self, lane, tile, x, y ):
+        """
+        Adds NumPy arrays of lane, tile, x and y read coordinates to the store, spilling a sorted run whenever the run buffer is full.
+        """
+        try:
+            packed=packCoordinateArrays(lane, tile, x, y)
+        except ValueError:
+            sys.exit("[FATAL] Read coordinates do not fit the tile store.")
+        done=0
+        while done < len(packed):
+            n=min(len(packed)-done, len(self.run)-self.size)
+            self.run[self.size:self.size+n]=packed[done:done+n]
+            (self.size, done)=(self.size+n, done+n)
+            if self.size == len(self.run):
+                self.spill()
+
+    def spill( self ):
+        """
+        Sorts the run buffer, records its tiles and writes it to a run file.
+        """
+        run=self.run[:self.size]
+        self.run_files.append(spillSortedRun(run, self.run_dir, len(self.run_files), unique=False))
+        self.tiles.update(np.unique(run >> np.uint64(X_BITS+Y_BITS)).tolist())
+        self.count+=self.size
+        self.size=0
+
+    def close( self ):
+        """
+        Merges the run files into the store file and removes them. Returns the number of reads written.
+        """
+        if self.size:
+            self.spill()
+        self.run=None
+        tiles=sorted(self.tiles)
+        # offsets and counts of the tiles, in tile order, filled while merging
+        table=np.zeros(len(tiles), dtype=TILE_TABLE_DTYPE)
+        table['lane']=[i >> TILE_BITS for i in tiles]
+        table['tile']=[i & ((1 << TILE_BITS)-1) for i in tiles]
+        positions={key: n for (n, key) in enumerate(tiles)}
+        header={'version': STORE_VERSION, 'tiles': len(tiles), 'count': self.count, 'sorted': True, 'fields': list(COORD_DTYPE.names)}
+        header_bytes=json.dumps(header).encode()
+        header_bytes+=b' '*(-(len(STORE_MAGIC)+8+len(header_bytes)) % 8)
+        block_size=max(STORE_RUN_READS//max(len(self.run_files), 1), 4096)
+        with open(self.store_file, 'wb') as f:
+            f.write(STORE_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            table_start=f.tell()
+            table.tofile(f)
+            for block in mergeSortedRuns(self.run_files, block_size, unique=False):
+                coords=np.empty(len(block), dtype=COORD_DTYPE)
+                coords['x']=(block >> np.uint64(Y_BITS)) & np.uint64((1 << X_BITS)-1)
+                coords['y']=block & np.uint64((1 << Y_BITS)-1)
+                coords.tofile(f)
+                (keys, counts)=np.unique(block >> np.uint64(X_BITS+Y_BITS), return_counts=True)
+                for (key, n) in zip(keys.tolist(), counts.tolist()):
+                    table['count'][positions[key]]+=n
+            table['offset']=np.concatenate(([0], np.cumsum(table['count'])[:-1])) if len(tiles) else []
+            f.seek(table_start)
+            table.tofile(f)
+        shutil.rmtree(self.run_dir)
+        return(self.count)